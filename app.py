@@ -1,11 +1,25 @@
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import (Flask, render_template, request, flash, redirect, session,
+                   g, abort, stream_template)
+from sqlalchemy import delete, select
 from sqlalchemy.exc import IntegrityError
 
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm
-from models import db, connect_db, User, Message, Likes
+from models import db, connect_db, User, Message, Likes, Follows
+from cache import cache
+import counters
+import current_user
+import feeds
+from likes import toggle_like
+from metrics import metrics
+from passwords import hasher, PasswordHasherBusy
+from profiler import profiler
+from querybudget import query_budget
+from search import search_users
+from slowqueries import slow_queries
+import timelines
+from writebehind import write_behind
 
 CURR_USER_KEY = "curr_user"
 
@@ -18,11 +32,64 @@ app.config['SQLALCHEMY_DATABASE_URI'] = (
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-toolbar = DebugToolbarExtension(app)
+
+# Where precomputed timelines live: 'memory://' (this process only) or
+# 'file:///path/to/cache.sqlite' (shared by all workers on the box).
+app.config['CACHE_URL'] = os.environ.get('CACHE_URL', 'memory://')
+
+# Most entries the memory:// cache keeps (least recently used go first)
+app.config['CACHE_MAX_ENTRIES'] = int(
+    os.environ.get('CACHE_MAX_ENTRIES', 2000))
+
+# Users per page of the /users directory and search results
+app.config['USERS_PER_PAGE'] = int(os.environ.get('USERS_PER_PAGE', 48))
+
+# bcrypt cost, and how many hashes may run (and wait) at once; see passwords.py
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+if 'PASSWORD_HASH_WORKERS' in os.environ:
+    app.config['PASSWORD_HASH_WORKERS'] = int(
+        os.environ['PASSWORD_HASH_WORKERS'])
+
+# Queue likes and follows and write them in batches; see writebehind.py
+app.config['WRITE_BEHIND'] = bool(os.environ.get('WRITE_BEHIND'))
+app.config['WRITE_BEHIND_INTERVAL'] = float(
+    os.environ.get('WRITE_BEHIND_INTERVAL', 0.5))
+
+# Serve Prometheus metrics at /metrics, only to scrapers sending
+# "Authorization: Bearer <METRICS_TOKEN>"; see metrics.py
+app.config['METRICS_ENABLED'] = bool(os.environ.get('METRICS_ENABLED'))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
+# Log statements slower than this many seconds, with an EXPLAIN ANALYZE of
+# this share of the slow SELECTs on Postgres (cut off after
+# SLOW_QUERY_EXPLAIN_TIMEOUT seconds); see slowqueries.py
+app.config['SLOW_QUERY_THRESHOLD'] = float(
+    os.environ.get('SLOW_QUERY_THRESHOLD', 0.5))
+app.config['SLOW_QUERY_EXPLAIN_RATE'] = float(
+    os.environ.get('SLOW_QUERY_EXPLAIN_RATE', 0.1))
+app.config['SLOW_QUERY_EXPLAIN_TIMEOUT'] = float(
+    os.environ.get('SLOW_QUERY_EXPLAIN_TIMEOUT', 5))
+
+# Where profiles of single requests are saved; see profiler.py
+if 'PROFILE_DIR' in os.environ:
+    app.config['PROFILE_DIR'] = os.environ['PROFILE_DIR']
+
+# The debug toolbar is for development only (`flask run --debug`, or set
+# DEBUG_TOOLBAR); production never loads it.
+if app.debug or os.environ.get('DEBUG_TOOLBAR'):
+    from flask_debugtoolbar import DebugToolbarExtension
+    app.config['DEBUG_TB_ENABLED'] = True
+    app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+    toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+metrics.init_app(app)
+slow_queries.init_app(app)
+profiler.init_app(app, user_id=lambda: session.get(CURR_USER_KEY))
+cache.init_app(app)
+hasher.init_app(app)
+write_behind.init_app(app)
 
 
 ##############################################################################
@@ -31,13 +98,17 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
 
-    if CURR_USER_KEY in session:
-        g.user = db.session.get(User, session[CURR_USER_KEY])
-        # g.user = User.query.get(session[CURR_USER_KEY])
-        # g.user = session.get()
-        # print('add user to g:', g.user)
+    Static files don't need a user, so they skip this; other requests get
+    the user's cached display fields (see current_user.py).
+    """
+
+    if request.endpoint and request.endpoint.rsplit('.', 1)[-1] == 'static':
+        g.user = None
+
+    elif CURR_USER_KEY in session:
+        g.user = current_user.load(session[CURR_USER_KEY])
 
     else:
         g.user = None
@@ -50,6 +121,15 @@ def do_login(user):
     session[CURR_USER_KEY] = user.id
 
 
+def get_cursor():
+    """Decode the `before` pagination cursor from the query string."""
+
+    try:
+        return feeds.decode_cursor(request.args.get('before'))
+    except ValueError:
+        abort(400)
+
+
 def do_logout():
     """Logout user."""
 
@@ -58,6 +138,7 @@ def do_logout():
 
 
 @app.route('/signup', methods=["GET", "POST"])
+@query_budget(2)
 def signup():
     """Handle user signup.
 
@@ -94,6 +175,7 @@ def signup():
 
 
 @app.route('/login', methods=["GET", "POST"])
+@query_budget(2)
 def login():
     """Handle user login."""
 
@@ -104,6 +186,7 @@ def login():
                                  form.password.data)
 
         if user:
+            db.session.commit()  # save the password if it was rehashed
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -114,11 +197,12 @@ def login():
 
 
 @app.route('/logout')
+@query_budget(1)
 def logout():
     """Handle logout of user."""
-    user = User.query.get_or_404(session[CURR_USER_KEY])
+    if g.user:
+        flash(f"See you later, {g.user.username}!", "success")
     do_logout()
-    flash(f"See you later, {user.username}!", "success")
     return redirect("/")
 
     # IMPLEMENT THIS
@@ -128,23 +212,44 @@ def logout():
 # General user routes:
 
 @app.route('/users')
+@query_budget(5)
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username, and an
+    'after' param (the cursor from the previous page) to page through the
+    results.
+
+    Without 'q', lists everyone a page at a time in id order ('after' is
+    the last id on the previous page). The page is streamed: rows are read
+    from the database and cards sent to the browser as the template renders.
     """
 
     search = request.args.get('q')
+    per_page = app.config['USERS_PER_PAGE']
 
     if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
-
-    return render_template('users/index.html', users=users)
+        after = request.args.get('after', 0, type=int)
+        users = db.session.scalars(
+            select(User)
+            .where(User.id > after)
+            .order_by(User.id)
+            .limit(per_page)
+            .execution_options(yield_per=per_page))
+        return app.response_class(stream_template(
+            'users/index.html', users=users, per_page=per_page))
+
+    try:
+        users, next_cursor = search_users(search, request.args.get('after'),
+                                          per_page)
+    except ValueError:
+        abort(400)
+    return render_template('users/index.html', users=users, q=search,
+                           next_cursor=next_cursor)
 
 
 @app.route('/users/<int:user_id>')
+@query_budget(6)
 def users_show(user_id):
     """Show user profile."""
 
@@ -152,16 +257,15 @@ def users_show(user_id):
 
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    messages, next_cursor = feeds.paginate(
+        feeds.user_messages_query(user_id), get_cursor())
+    return render_template('users/show.html', user=user, messages=messages,
+                           like_counts=feeds.like_counts(messages),
+                           next_cursor=next_cursor)
 
 
 @app.route('/users/<int:user_id>/following')
+@query_budget(4)
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -172,10 +276,23 @@ def show_following(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    following = user.following
+
+    # show follows and unfollows still in the write-behind queue
+    pending = write_behind.pending_follows(user_id)
+    if pending:
+        following = [u for u in following if pending.get(u.id, True)]
+        shown = {u.id for u in following}
+        added = [followed_id for followed_id, wanted in pending.items()
+                 if wanted and followed_id not in shown]
+        following += User.query.filter(User.id.in_(added)).all()
+
+    return render_template('users/following.html', user=user,
+                           following=following)
 
 
 @app.route('/users/<int:user_id>/followers')
+@query_budget(4)
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -187,12 +304,8 @@ def users_followers(user_id):
     return render_template('users/followers.html', user=user)
 
 
-def sort_and_limit_messages(messages):
-    m = sorted(messages, key=lambda x: x.timestamp, reverse=True)[:100]
-    return m
-
-
 @app.route('/users/<int:user_id>/likes')
+@query_budget(4)
 def users_likes(user_id):
     """Show list of liked messages of this user."""
 
@@ -201,11 +314,16 @@ def users_likes(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    messages = sort_and_limit_messages(user.likes)
-    return render_template('users/show.html', user=user, messages=messages)
+    messages, next_cursor = feeds.paginate(
+        feeds.liked_messages_query(user_id), get_cursor(),
+        order=feeds.LIKED_ORDER)
+    return render_template('users/show.html', user=user, messages=messages,
+                           like_counts=feeds.like_counts(messages),
+                           next_cursor=next_cursor)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
+@query_budget(7)
 def add_follow(follow_id):
     """Add a follow for the currently-logged-in user."""
 
@@ -213,14 +331,20 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
+    User.query.get_or_404(follow_id)
+    if write_behind.enabled:
+        write_behind.set_follow(g.user.id, follow_id, True)
+    elif not db.session.get(Follows, (follow_id, g.user.id)):
+        db.session.add(Follows(user_being_followed_id=follow_id,
+                               user_following_id=g.user.id))
+        db.session.commit()
+    timelines.add_followed(g.user.id, follow_id)
 
     return redirect(f"/users/{g.user.id}/following")
 
 
 @app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
+@query_budget(5)
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user."""
 
@@ -228,21 +352,25 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
-    db.session.commit()
+    if write_behind.enabled:
+        write_behind.set_follow(g.user.id, follow_id, False)
+    elif follow := db.session.get(Follows, (follow_id, g.user.id)):
+        db.session.delete(follow)
+        db.session.commit()
+    timelines.remove_followed(g.user.id, follow_id)
 
     return redirect(f"/users/{g.user.id}/following")
 
 
 @app.route('/users/profile', methods=["GET", "POST"])
+@query_budget(4)
 def profile():
     """Update profile for current user."""
 
     form = UserEditForm()
     if form.validate_on_submit():
-        user = User.authenticate(form.username.data,
-                                 form.password.data)
+        # check the password of the current user, not the (new) username
+        user = User.authenticate(g.user.username, form.password.data)
         if user:
             user.username = form.username.data
             user.email = form.email.data
@@ -252,6 +380,7 @@ def profile():
             user.header_image_url = form.header_image_url.data
             db.session.add(user)
             db.session.commit()
+            current_user.forget(user.id)
             flash(f"{user.username}, your profile was updated", "success")
             return redirect("/")
         else:
@@ -265,6 +394,7 @@ def profile():
 
 
 @app.route('/users/delete', methods=["POST"])
+@query_budget(17)
 def delete_user():
     """Delete user."""
 
@@ -274,8 +404,23 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    user_id = g.user.id
+    related_user_ids = counters.related_user_ids(user_id)
+    audience_ids = timelines.audience_ids(user_id)
+
+    # Remove their messages (and likes of them) in bulk; left to the ORM,
+    # it would try to null out each message's user_id.
+    user_messages = select(Message.id).where(Message.user_id == user_id)
+    db.session.execute(
+        delete(Likes).where(Likes.message_id.in_(user_messages)))
+    db.session.execute(delete(Message).where(Message.user_id == user_id))
+    db.session.delete(g.user.row)
+    db.session.flush()
+    counters.recount(related_user_ids)
     db.session.commit()
+    current_user.forget(user_id)
+    timelines.drop_timeline(user_id)
+    timelines.remove_author(user_id, audience_ids)
 
     return redirect("/signup")
 
@@ -284,6 +429,7 @@ def delete_user():
 # Messages routes:
 
 @app.route('/messages/new', methods=["GET", "POST"])
+@query_budget(7)
 def messages_add():
     """Add a message:
 
@@ -300,6 +446,7 @@ def messages_add():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
         db.session.commit()
+        timelines.fan_out(msg)
 
         return redirect(f"/users/{g.user.id}")
 
@@ -307,14 +454,16 @@ def messages_add():
 
 
 @app.route('/messages/<int:message_id>', methods=["GET"])
+@query_budget(4)
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
+    msg = feeds.get_message_or_404(message_id)
     return render_template('messages/show.html', message=msg)
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
+@query_budget(7)
 def messages_destroy(message_id):
     """Delete a message."""
 
@@ -328,8 +477,10 @@ def messages_destroy(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    counters.delete_likes_of_message(message_id)
     db.session.delete(msg)
     db.session.commit()
+    timelines.remove_message(message_id, g.user.id)
 
     return redirect(f"/users/{g.user.id}")
 
@@ -339,25 +490,24 @@ def messages_destroy(message_id):
 
 
 @app.route('/')
+@query_budget(5)
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: most recent messages of followed_users, a page at a time
+      (older pages via the `before` cursor)
+
+    The message ids come from the user's precomputed timeline, so this costs
+    the same however many users they follow.
     """
 
     if g.user:
-        user_id_list = [g.user.id] + [user.id for user in g.user.following]
-        # print('user id list: ', user_id_list)
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(user_id_list))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-        likes = [msg.id for msg in g.user.likes]
-        # print('likes: ', likes)
-        return render_template('home.html', messages=messages, likes=likes)
+        messages, next_cursor = timelines.home_page(g.user.id, get_cursor())
+        likes = g.user.liked_ids(messages)
+        return render_template('home.html', messages=messages, likes=likes,
+                               like_counts=feeds.like_counts(messages),
+                               next_cursor=next_cursor)
 
     else:
         return render_template('home-anon.html')
@@ -366,21 +516,47 @@ def homepage():
 
 
 @app.route('/users/add_like/<int:msg_id>', methods=['POST'])
+@query_budget(4)
 def add_like(msg_id):
-    author_id = Message.query.get(msg_id).user_id
-    existing_like = Likes.query.filter(
-        Likes.message_id == msg_id and Likes.user_id == author_id).one_or_none()
-    if (not existing_like):
-        if (g.user.id != author_id):
-            like = Likes(user_id=g.user.id, message_id=msg_id)
-            db.session.add(like)
-            db.session.commit()
-    else:
-        db.session.delete(existing_like)
-        db.session.commit()
+    """Like a message for the currently-logged-in user, or unlike it."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    if write_behind.enabled:
+        msg = feeds.get_message_or_404(msg_id)
+        if msg.user_id != g.user.id:
+            liked = msg_id in g.user.liked_ids([msg])
+            write_behind.set_like(g.user.id, msg_id, not liked)
+
+    elif toggle_like(g.user.id, msg_id) is None:
+        # their own message (which is ignored), or no message at all
+        feeds.get_message_or_404(msg_id)
+
+    db.session.commit()
+
     return redirect('/')
 
 
+@app.errorhandler(current_user.UserGone)
+def current_user_gone(error):
+    """Log out a user whose account was deleted (e.g. by another worker)."""
+
+    do_logout()
+    g.user = None
+    flash("Your account no longer exists.", "danger")
+    return redirect("/")
+
+
+@app.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(error):
+    """Shed sign-in load when every password hashing slot is taken."""
+
+    return ("Lots of people are signing in right now; "
+            "please try again in a moment.", 503, {'Retry-After': '2'})
+
+
 ##############################################################################
 # Turn off all caching in Flask
 #   (useful for dev; in production, this kind of stuff is typically
@@ -0,0 +1,4 @@
+"""Benchmarks for Warbler; run them as modules, e.g.
+
+    python -m benchmarks.login_throughput
+"""
@@ -0,0 +1,120 @@
+"""Throughput of concurrent like toggles.
+
+Creates some users and messages, then has client threads toggle likes on
+random messages as fast as they can, all clicking the same few messages
+so toggles contend. Prints toggles per second, then checks that every
+`likes_count` still matches the likes table:
+
+    python -m benchmarks.like_toggles --threads 8 --messages 20
+
+Uses a scratch SQLite database unless DATABASE_URL is set.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(
+        tempfile.mkdtemp(), 'like_toggles.db')
+
+from sqlalchemy import func, select                     # noqa: E402
+
+from app import app                                     # noqa: E402
+from models import db, User, Message, Likes             # noqa: E402
+from likes import toggle_like                           # noqa: E402
+
+
+def make_data(n_users, n_messages):
+    """Create benchmark users and messages; return (user ids, message ids)."""
+
+    users = [User(email=f'bench{i}@test.com', username=f'bench-likes-{i}',
+                  password='HASHED_PASSWORD') for i in range(n_users + 1)]
+    db.session.add_all(users)
+    db.session.commit()
+
+    author = users[0]
+    messages = [Message(text=f'message {i}', user_id=author.id)
+                for i in range(n_messages)]
+    db.session.add_all(messages)
+    db.session.commit()
+
+    return [user.id for user in users[1:]], [msg.id for msg in messages]
+
+
+def drop_data(user_ids, message_ids):
+    Likes.query.filter(Likes.message_id.in_(message_ids)).delete()
+    Message.query.filter(Message.id.in_(message_ids)).delete()
+    User.query.filter(User.username.like('bench-likes-%')).delete()
+    db.session.commit()
+
+
+def run(user_ids, message_ids, threads, duration):
+    """Toggles per second, and how many failed."""
+
+    counts = {'ok': 0, 'failed': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client_loop():
+        rng = random.Random()
+        with app.app_context():
+            while time.monotonic() < deadline:
+                try:
+                    toggle_like(rng.choice(user_ids), rng.choice(message_ids))
+                    db.session.commit()
+                    outcome = 'ok'
+                except Exception:
+                    db.session.rollback()
+                    outcome = 'failed'
+                with lock:
+                    counts[outcome] += 1
+
+    started = time.monotonic()
+    workers = [threading.Thread(target=client_loop) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+
+    return counts['ok'] / elapsed, counts['failed']
+
+
+def miscounted(user_ids):
+    """Ids of users whose likes_count doesn't match their likes."""
+
+    actual = dict(db.session.execute(
+        select(Likes.user_id, func.count())
+        .where(Likes.user_id.in_(user_ids))
+        .group_by(Likes.user_id)).all())
+    db.session.expire_all()
+    return [user.id for user in User.query.filter(User.id.in_(user_ids))
+            if user.likes_count != actual.get(user.id, 0)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=5)
+    args = parser.parse_args()
+
+    db.create_all()
+    user_ids, message_ids = make_data(args.users, args.messages)
+    try:
+        rate, failed = run(user_ids, message_ids, args.threads, args.duration)
+        print(f'{rate:.1f} toggles/s with {args.threads} threads '
+              f'({failed} failed)')
+        wrong = miscounted(user_ids)
+        print(f'likes_count mismatches: {len(wrong)}')
+    finally:
+        drop_data(user_ids, message_ids)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Login throughput at several bcrypt costs.
+
+Logs one user in over and over from concurrent client threads, with the
+password hashed at each cost in turn, and prints logins per second:
+
+    python -m benchmarks.login_throughput --costs 4 8 10 12 --threads 8
+
+Uses a scratch SQLite database unless DATABASE_URL is set.
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(
+        tempfile.mkdtemp(), 'login_throughput.db')
+
+from app import app                                     # noqa: E402
+from models import db, User                             # noqa: E402
+from passwords import hasher                            # noqa: E402
+
+USERNAME = 'benchmark-login'
+PASSWORD = 'benchmark-password'
+
+
+def make_user(cost):
+    """(Re)create the benchmark user, hashed at `cost`."""
+
+    User.query.filter_by(username=USERNAME).delete()
+    hasher.rounds = cost
+    User.signup(username=USERNAME, email=f'{USERNAME}@test.com',
+                password=PASSWORD, image_url=None)
+    db.session.commit()
+
+
+def run(cost, threads, duration):
+    """Logins per second, 503s and other failures at `cost`."""
+
+    make_user(cost)
+    counts = {'ok': 0, 'busy': 0, 'failed': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client_loop():
+        client = app.test_client()
+        while time.monotonic() < deadline:
+            resp = client.post('/login', data={'username': USERNAME,
+                                               'password': PASSWORD})
+            if resp.status_code == 302:
+                outcome = 'ok'
+            elif resp.status_code == 503:
+                outcome = 'busy'    # PasswordHasherBusy
+            else:
+                outcome = 'failed'
+            with lock:
+                counts[outcome] += 1
+
+    started = time.monotonic()
+    workers = [threading.Thread(target=client_loop) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+
+    return counts['ok'] / elapsed, counts['busy'], counts['failed']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--costs', type=int, nargs='+', default=[4, 8, 10, 12])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5,
+                        help='seconds per cost')
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    db.create_all()
+
+    print(f"{'cost':>4}  {'logins/s':>9}  {'503s':>6}  {'failed':>6}")
+    for cost in args.costs:
+        rate, busy, failed = run(cost, args.threads, args.duration)
+        print(f'{cost:>4}  {rate:>9.1f}  {busy:>6}  {failed:>6}')
+
+    User.query.filter_by(username=USERNAME).delete()
+    db.session.commit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+"""Latency, throughput and query counts for the routes Warbler serves.
+
+Seeds a database at the requested scale (with generator/create_csvs.py
+and loader.py, plus random likes), then runs concurrent simulated
+sessions. Each session is logged in as a random user and picks routes by
+weight (see ROUTES), reads and writes alike. Afterwards it prints, and
+with --out saves as JSON, each route's p50/p95/p99 latency, requests per
+second and SQL queries per request:
+
+    python -m benchmarks.routes --users 10000 --messages 100000 \\
+        --follows 200000 --likes 100000 --sessions 8 --duration 30 \\
+        --out bench-$(git rev-parse --short HEAD).json
+
+Requests go through the WSGI app in-process (a Flask test client per
+session), so the numbers cover the app and the database, not a web server.
+
+Uses a scratch SQLite database unless DATABASE_URL is set (e.g. to a local
+Postgres). Seeding drops and recreates every table, so for a DATABASE_URL
+it only happens with --seed-db; without it, the data already there is used.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+SCRATCH = 'DATABASE_URL' not in os.environ
+if SCRATCH:
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(
+        tempfile.mkdtemp(), 'routes.db')
+
+import numpy as np                                      # noqa: E402
+from sqlalchemy import event, func, select              # noqa: E402
+
+from app import app, CURR_USER_KEY                      # noqa: E402
+from models import db, User, Message                    # noqa: E402
+import counters                                         # noqa: E402
+import loader                                           # noqa: E402
+import migrations                                       # noqa: E402
+from writebehind import write_likes                     # noqa: E402
+
+GENERATOR = os.path.join(os.path.dirname(__file__), '..', 'generator',
+                         'create_csvs.py')
+
+LIKES_BATCH_SIZE = 10_000
+
+# Search terms for /users?q=: short prefixes and longer substrings
+SEARCH_TERMS = ['a', 'jo', 'ann', 'mar', 'son', 'smith', 'lee', 'zz']
+
+
+##############################################################################
+# Seeding
+
+
+def seed(args, echo=print):
+    """Recreate the tables and fill them at the scale in `args`."""
+
+    db.drop_all()
+    db.create_all()
+    migrations.stamp()
+
+    with tempfile.TemporaryDirectory() as out:
+        subprocess.run(
+            [sys.executable, GENERATOR, '--out', out,
+             '--users', str(args.users), '--messages', str(args.messages),
+             '--follows', str(args.follows), '--profile', args.profile,
+             '--seed', str(args.seed)],
+            check=True, stdout=subprocess.DEVNULL)
+        loader.load_files(
+            [(table, os.path.join(out, f'{table}.csv'))
+             for table in ('users', 'messages', 'follows')],
+            echo=echo)
+
+    rng = np.random.default_rng(args.seed)
+    for start in range(0, args.likes, LIKES_BATCH_SIZE):
+        size = min(LIKES_BATCH_SIZE, args.likes - start)
+        pairs = zip(rng.integers(1, args.users + 1, size).tolist(),
+                    rng.integers(1, args.messages + 1, size).tolist())
+        write_likes({pair: True for pair in pairs})
+        db.session.commit()
+
+    counters.recount_all(echo=echo)
+    echo(f"Seeded {args.users} users, {args.messages} messages, "
+         f"{args.follows} follows and up to {args.likes} likes")
+
+
+def sample_message_ids(seed, size=10_000):
+    """Up to `size` message ids to like, the same ones for the same `seed`."""
+
+    max_id = db.session.scalar(select(func.max(Message.id))) or 0
+    picks = random.Random(seed).sample(range(1, max_id + 1),
+                                       min(size, max_id))
+    return list(db.session.scalars(
+        select(Message.id).where(Message.id.in_(picks))
+        .order_by(Message.id)))
+
+
+##############################################################################
+# Routes
+
+
+def other_user(session):
+    return session['rng'].choice(session['user_ids'])
+
+
+def route_home(client, session):
+    return client.get('/')
+
+
+def route_profile(client, session):
+    return client.get(f"/users/{other_user(session)}")
+
+
+def route_following(client, session):
+    return client.get(f"/users/{session['user_id']}/following")
+
+
+def route_likes(client, session):
+    return client.get(f"/users/{session['user_id']}/likes")
+
+
+def route_search(client, session):
+    return client.get(f"/users?q={session['rng'].choice(SEARCH_TERMS)}")
+
+
+def route_like(client, session):
+    message_id = session['rng'].choice(session['message_ids'])
+    return client.post(f"/users/add_like/{message_id}")
+
+
+def route_follow(client, session):
+    return client.post(f"/users/follow/{other_user(session)}")
+
+
+def route_unfollow(client, session):
+    return client.post(f"/users/stop-following/{other_user(session)}")
+
+
+def route_post(client, session):
+    return client.post('/messages/new', data={'text': 'Benchmarking!'})
+
+
+# name -> (function making the request, relative weight)
+ROUTES = {
+    'GET /': (route_home, 30),
+    'GET /users/<id>': (route_profile, 20),
+    'GET /users/<id>/following': (route_following, 8),
+    'GET /users/<id>/likes': (route_likes, 8),
+    'GET /users?q=': (route_search, 8),
+    'POST /users/add_like/<id>': (route_like, 12),
+    'POST /users/follow/<id>': (route_follow, 5),
+    'POST /users/stop-following/<id>': (route_unfollow, 5),
+    'POST /messages/new': (route_post, 4),
+}
+
+
+##############################################################################
+# Running and reporting
+
+
+class QueryCounter:
+    """Counts SQL statements run by each thread."""
+
+    def __init__(self):
+        self.local = threading.local()
+        event.listen(db.engine, 'before_cursor_execute', self.count)
+
+    def count(self, *args):
+        self.local.count = getattr(self.local, 'count', 0) + 1
+
+    def take(self):
+        """Statements run by this thread since the last take()."""
+
+        count = getattr(self.local, 'count', 0)
+        self.local.count = 0
+        return count
+
+
+def run(args, user_ids, message_ids):
+    """Run the sessions; returns {route: [(seconds, queries, status)]}."""
+
+    names = list(ROUTES)
+    weights = [ROUTES[name][1] for name in names]
+    samples = {name: [] for name in names}
+    lock = threading.Lock()
+    queries = QueryCounter()
+    deadline = time.monotonic() + args.duration
+
+    def session_loop(number):
+        # each session's own stream, so --seed repeats every session's picks
+        rng = random.Random(args.seed * 1000 + number)
+        client = app.test_client()
+        session = {'user_id': rng.choice(user_ids), 'rng': rng,
+                   'user_ids': user_ids, 'message_ids': message_ids}
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = session['user_id']
+
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            queries.take()
+            started = time.perf_counter()
+            resp = ROUTES[name][0](client, session)
+            resp.get_data()  # finish streamed responses
+            elapsed = time.perf_counter() - started
+            with lock:
+                samples[name].append(
+                    (elapsed, queries.take(), resp.status_code))
+
+    threads = [threading.Thread(target=session_loop, args=(number,))
+               for number in range(args.sessions)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.monotonic() - started
+
+
+def percentile(values, pct):
+    """The `pct`th percentile of sorted `values` (nearest rank)."""
+
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def summarize(samples, wall_time):
+    """Per-route latency, throughput and query statistics."""
+
+    results = {}
+    for name, rows in samples.items():
+        if not rows:
+            continue
+        latencies = sorted(elapsed for elapsed, _, _ in rows)
+        results[name] = {
+            'requests': len(rows),
+            'errors': sum(status >= 400 for _, _, status in rows),
+            'req_per_sec': len(rows) / wall_time,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'queries_per_request': sum(q for _, q, _ in rows) / len(rows),
+        }
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print(f"{'route':<34}{'reqs':>7}{'req/s':>9}{'p50 ms':>9}"
+          f"{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'errors':>8}")
+    for name, r in results.items():
+        print(f"{name:<34}{r['requests']:>7}{r['req_per_sec']:>9.1f}"
+              f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}"
+              f"{r['queries_per_request']:>9.1f}{r['errors']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--seed-db', dest='seed_db', action='store_true',
+                        help="recreate and seed the database first "
+                             "(always done for the scratch database)")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=10_000)
+    parser.add_argument('--follows', type=int, default=20_000)
+    parser.add_argument('--likes', type=int, default=10_000)
+    parser.add_argument('--profile', default='uniform',
+                        help="generator workload profile")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sessions', type=int, default=4,
+                        help="concurrent simulated sessions")
+    parser.add_argument('--duration', type=float, default=10,
+                        help="seconds to run for")
+    parser.add_argument('--out', help="file to save the results to (JSON)")
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    if SCRATCH or args.seed_db:
+        seed(args)
+
+    user_ids = list(db.session.scalars(select(User.id)))
+    message_ids = sample_message_ids(args.seed)
+    if not user_ids or not message_ids:
+        sys.exit("No users or messages to browse; run with --seed-db")
+
+    samples, wall_time = run(args, user_ids, message_ids)
+    results = summarize(samples, wall_time)
+    print_results(results)
+
+    if args.out:
+        total = sum(len(rows) for rows in samples.values())
+        report = {
+            'commit': git_commit(),
+            'run_at': datetime.utcnow().isoformat(),
+            'database': db.engine.dialect.name,
+            'args': vars(args),
+            'wall_time': wall_time,
+            'req_per_sec': total / wall_time,
+            'routes': results,
+        }
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""Key/value cache backends for Warbler.
+
+The in-process backend is the default. It holds at most CACHE_MAX_ENTRIES
+entries, evicting the least recently used, and each worker process has its
+own. The file backend keeps entries in a local SQLite file, so every worker
+process on the box sees the same data; it stands in for a shared cache
+(Redis, memcached) in development.
+"""
+
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 2000
+
+
+class MemoryCache:
+    """Cache held in this process's memory, least recently used out first."""
+
+    # whether other worker processes see what's stored
+    shared = False
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return value stored under `key`, or None."""
+
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        """Store `value` under `key`."""
+
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def update(self, key, fn):
+        """Atomically replace the value under `key` with `fn(value)`.
+
+        Does nothing if `key` isn't present; returns the new value (or None).
+        """
+
+        with self._lock:
+            if key not in self._data:
+                return None
+            value = self._data[key] = fn(self._data[key])
+            self._data.move_to_end(key)
+            return value
+
+    def delete(self, key):
+        """Remove `key` (if present)."""
+
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove everything."""
+
+        with self._lock:
+            self._data.clear()
+
+
+class FileCache:
+    """Cache kept in a local SQLite file shared by all worker processes.
+
+    Values are stored as JSON, so (like a real shared cache) they must be
+    made of plain lists, dicts, strings and numbers.
+    """
+
+    shared = True
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache "
+                         "(key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            "SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)",
+            (key, json.dumps(value)))
+
+    def update(self, key, fn):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            value = None
+            if row:
+                value = fn(json.loads(row[0]))
+                conn.execute("UPDATE cache SET value = ? WHERE key = ?",
+                             (json.dumps(value), key))
+            conn.execute("COMMIT")
+            return value
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        self._connect().execute("DELETE FROM cache")
+
+
+def backend_for_url(url, max_entries=DEFAULT_MAX_ENTRIES):
+    """Make a cache backend from a URL like `memory://` or `file:///path`."""
+
+    if url.startswith('memory://'):
+        return MemoryCache(max_entries)
+    if url.startswith('file://'):
+        return FileCache(url[len('file://'):])
+    raise ValueError(f"Unknown CACHE_URL: {url}")
+
+
+class Cache:
+    """Front for whichever backend the app is configured to use.
+
+    Like `db`, it's created at import time and bound to the app later with
+    `init_app`, so other modules can import it directly.
+    """
+
+    def __init__(self):
+        self.backend = MemoryCache()
+
+    def init_app(self, app):
+        self.backend = backend_for_url(
+            app.config.get('CACHE_URL', 'memory://'),
+            app.config.setdefault('CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+
+cache = Cache()
@@ -0,0 +1,158 @@
+"""Denormalized per-user counters for Warbler.
+
+`User.messages_count`, `following_count`, `followers_count` and
+`likes_count` are kept up to date by the ORM events below: whenever a
+Message, Follows or Likes row is inserted or deleted through the session,
+the matching counters are bumped with an UPDATE in the same transaction.
+
+Writes that bypass the ORM (bulk loads, database-level cascades) need a
+`recount` afterwards. To rebuild every counter from the base tables:
+
+    python counters.py recount
+"""
+
+import sys
+
+from sqlalchemy import event, func, select, update
+
+from models import db, User, Message, Follows, Likes
+
+COUNTERS = ['messages_count', 'following_count', 'followers_count',
+            'likes_count']
+
+RECOUNT_BATCH_SIZE = 10_000
+
+
+def bump(connection, user_id, **deltas):
+    """Add `deltas` (e.g. likes_count=-1) to user `user_id`'s counters."""
+
+    if user_id is None:
+        return
+
+    users = User.__table__
+    connection.execute(
+        update(users)
+        .where(users.c.id == user_id)
+        .values({name: users.c[name] + delta
+                 for name, delta in deltas.items()}))
+
+
+@event.listens_for(Message, 'after_insert')
+def message_added(mapper, connection, msg):
+    bump(connection, msg.user_id, messages_count=1)
+
+
+@event.listens_for(Message, 'after_delete')
+def message_deleted(mapper, connection, msg):
+    bump(connection, msg.user_id, messages_count=-1)
+
+
+@event.listens_for(Follows, 'after_insert')
+def follow_added(mapper, connection, follow):
+    bump(connection, follow.user_following_id, following_count=1)
+    bump(connection, follow.user_being_followed_id, followers_count=1)
+
+
+@event.listens_for(Follows, 'after_delete')
+def follow_deleted(mapper, connection, follow):
+    bump(connection, follow.user_following_id, following_count=-1)
+    bump(connection, follow.user_being_followed_id, followers_count=-1)
+
+
+@event.listens_for(Likes, 'after_insert')
+def like_added(mapper, connection, like):
+    bump(connection, like.user_id, likes_count=1)
+
+
+@event.listens_for(Likes, 'after_delete')
+def like_deleted(mapper, connection, like):
+    bump(connection, like.user_id, likes_count=-1)
+
+
+def delete_likes_of_message(message_id):
+    """Delete every like of a message, adjusting the likers' counters.
+
+    Set-based, so it costs two statements however many likes there are.
+    """
+
+    users = User.__table__
+    likers = select(Likes.user_id).where(Likes.message_id == message_id)
+    db.session.execute(
+        update(users)
+        .where(users.c.id.in_(likers))
+        .values(likes_count=users.c.likes_count - 1))
+    db.session.execute(
+        Likes.__table__.delete().where(Likes.message_id == message_id))
+
+
+def related_user_ids(user_id):
+    """Ids of users whose counters change when `user_id` is deleted."""
+
+    followed = (select(Follows.user_being_followed_id)
+                .where(Follows.user_following_id == user_id))
+    followers = (select(Follows.user_following_id)
+                 .where(Follows.user_being_followed_id == user_id))
+    likers = (select(Likes.user_id)
+              .join(Message, Message.id == Likes.message_id)
+              .where(Message.user_id == user_id))
+    return {uid for stmt in (followed, followers, likers)
+            for uid in db.session.scalars(stmt)}
+
+
+def recount_statement():
+    """UPDATE setting every counter from the base tables."""
+
+    users = User.__table__
+    return update(users).values(
+        messages_count=(select(func.count())
+                        .where(Message.user_id == users.c.id)
+                        .scalar_subquery()),
+        following_count=(select(func.count())
+                         .where(Follows.user_following_id == users.c.id)
+                         .scalar_subquery()),
+        followers_count=(select(func.count())
+                         .where(Follows.user_being_followed_id == users.c.id)
+                         .scalar_subquery()),
+        likes_count=(select(func.count())
+                     .where(Likes.user_id == users.c.id)
+                     .scalar_subquery()),
+    )
+
+
+def recount(user_ids=None, connection=None):
+    """Rebuild counters for `user_ids` (default: everyone).
+
+    Runs on `connection` if given, otherwise in the current session; the
+    caller commits.
+    """
+
+    executor = connection if connection is not None else db.session
+    stmt = recount_statement()
+    if user_ids is not None:
+        stmt = stmt.where(User.__table__.c.id.in_(list(user_ids)))
+    executor.execute(stmt)
+
+
+def recount_all(batch_size=RECOUNT_BATCH_SIZE, echo=print):
+    """Rebuild every user's counters, committing a batch of ids at a time.
+
+    Batching by id range keeps each transaction (and its locks) short on a
+    large users table.
+    """
+
+    users = User.__table__
+    max_id = db.session.scalar(select(func.max(users.c.id))) or 0
+    for start in range(0, max_id + 1, batch_size):
+        db.session.execute(
+            recount_statement()
+            .where(users.c.id.between(start, start + batch_size - 1)))
+        db.session.commit()
+        echo(f"Recounted users {start}..{min(start + batch_size - 1, max_id)}")
+
+
+if __name__ == '__main__':
+    import app  # noqa: F401 (connects db and pushes an app context)
+
+    if sys.argv[1:] != ['recount']:
+        sys.exit("usage: python counters.py recount")
+    recount_all()
@@ -0,0 +1,123 @@
+"""The logged-in user, loaded without a database hit on most requests.
+
+Every page shows the current user's id, username and avatar, but few need
+the rest of the row. `load` returns a CurrentUser holding just those display
+fields, read from the cache for up to DISPLAY_FIELDS_TTL seconds. Anything
+else (`.messages`, `.is_following(...)`, the counters) loads the full User
+row on first use, once per request.
+
+Views that change the fields call `forget`. The TTL bounds how stale other
+worker processes can be when the cache is per-process; if the account was
+deleted meanwhile, loading the full row raises UserGone, which app.py
+handles by logging the user out. Keys carry
+DISPLAY_FIELDS_VERSION, so changing DISPLAY_FIELDS (bump it) doesn't read
+old entries.
+"""
+
+import time
+from functools import cached_property
+
+from sqlalchemy import select
+
+from cache import cache
+import feeds
+from models import db, User
+from writebehind import write_behind
+
+DISPLAY_FIELDS = ('id', 'username', 'image_url', 'header_image_url')
+
+DISPLAY_FIELDS_VERSION = 1
+
+DISPLAY_FIELDS_TTL = 60
+
+
+def display_fields_key(user_id):
+    return f"user:v{DISPLAY_FIELDS_VERSION}:{user_id}"
+
+
+class UserGone(Exception):
+    """Raised when the logged-in user's row no longer exists."""
+
+
+class CurrentUser:
+    """Display fields of the logged-in user; the rest of User on demand."""
+
+    def __init__(self, fields):
+        self.__dict__.update(fields)
+
+    @cached_property
+    def row(self):
+        """The full User row (loaded the first time it's needed)."""
+
+        row = db.session.get(User, self.id)
+        if row is None:
+            forget(self.id)
+            raise UserGone(self.id)
+        return row
+
+    @property
+    def following_ids(self):
+        """Ids of the users they follow, including follows not yet written."""
+
+        pending = write_behind.pending_follows(self.id)
+        if not pending:
+            return self.row.following_ids
+
+        ids = set(self.row.following_ids)
+        for followed_id, wanted in pending.items():
+            if wanted:
+                ids.add(followed_id)
+            else:
+                ids.discard(followed_id)
+        return ids
+
+    def is_following(self, other_user):
+        """Are they following `other_user`?"""
+
+        return other_user.id in self.following_ids
+
+    def liked_ids(self, messages):
+        """Ids of the `messages` they like, including likes not yet written."""
+
+        liked = feeds.liked_ids(self.id, messages)
+        message_ids = {msg.id for msg in messages}
+        for msg_id, wanted in write_behind.pending_likes(self.id).items():
+            if wanted and msg_id in message_ids:
+                liked.add(msg_id)
+            else:
+                liked.discard(msg_id)
+        return liked
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.row, name)
+
+    def __repr__(self):
+        return f"<CurrentUser #{self.id}: {self.username}>"
+
+
+def load(user_id):
+    """CurrentUser for `user_id`, or None if there's no such user."""
+
+    key = display_fields_key(user_id)
+    cached = cache.get(key)
+    if cached and cached['expires'] > time.time():
+        return CurrentUser(cached['fields'])
+
+    columns = [getattr(User, name) for name in DISPLAY_FIELDS]
+    row = db.session.execute(
+        select(*columns).where(User.id == user_id)).first()
+    if row is None:
+        return None
+
+    fields = dict(zip(DISPLAY_FIELDS, row))
+    cache.set(key, {'expires': time.time() + DISPLAY_FIELDS_TTL,
+                    'fields': fields})
+    return CurrentUser(fields)
+
+
+def forget(user_id):
+    """Drop the cached display fields of `user_id` (after they change)."""
+
+    cache.delete(display_fields_key(user_id))
@@ -0,0 +1,164 @@
+"""Feed queries and cursor pagination for Warbler.
+
+Feeds are ordered newest first by `(Message.timestamp, Message.id)`. A page
+is fetched with a single query that seeks past the last message already
+shown (the `before` cursor), so a deep page costs the same as the first.
+
+The likes page is ordered by the copies of those columns kept on each like
+(`Likes.message_timestamp`, `Likes.message_id`), so its page is a seek on
+the likes index too, without sorting everything the user ever liked.
+
+Every feed loads messages through `with_authors`, which fetches each
+message's author in the same query; templates read `msg.user` on every row,
+and lazy loading would cost one more SELECT per message.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import func, or_, select, tuple_
+from sqlalchemy.orm import joinedload
+
+from models import db, Message, Likes, Follows
+
+MESSAGES_PER_PAGE = 100
+
+# Fixed-width, so encoded timestamps also sort correctly as plain strings.
+TIMESTAMP_FORMAT = '%Y%m%d%H%M%S%f'
+
+# (timestamp, id) columns each kind of feed is ordered and paged by
+MESSAGE_ORDER = (Message.timestamp, Message.id)
+LIKED_ORDER = (Likes.message_timestamp, Likes.message_id)
+
+
+def encode_cursor(msg):
+    """Cursor pointing just past message `msg`."""
+
+    return f"{msg.timestamp.strftime(TIMESTAMP_FORMAT)}-{msg.id}"
+
+
+def decode_cursor(cursor):
+    """Return `(timestamp, id)` for `cursor`, or None if there isn't one.
+
+    Raises ValueError for a malformed cursor.
+    """
+
+    if not cursor:
+        return None
+
+    timestamp, msg_id = cursor.split('-')
+    return datetime.strptime(timestamp, TIMESTAMP_FORMAT), int(msg_id)
+
+
+def with_authors(query):
+    """Message `query` that loads each message's author along with it."""
+
+    return query.options(joinedload(Message.user))
+
+
+def page_query(query, before=None, per_page=MESSAGES_PER_PAGE,
+               order=MESSAGE_ORDER):
+    """Query for one page of message `query`, plus one row to spot more."""
+
+    timestamp, msg_id = order
+    query = with_authors(query)
+    if before:
+        query = query.filter(tuple_(timestamp, msg_id) < before)
+
+    return (query
+            .order_by(timestamp.desc(), msg_id.desc())
+            .limit(per_page + 1))
+
+
+def paginate(query, before=None, per_page=MESSAGES_PER_PAGE,
+             order=MESSAGE_ORDER):
+    """Return `(messages, next_cursor)` for one page of message `query`.
+
+    `before` is a decoded cursor; next_cursor is None on the last page.
+    `order` is the pair of columns the feed is sorted by.
+    """
+
+    messages = page_query(query, before, per_page, order).all()
+
+    if len(messages) > per_page:
+        messages = messages[:per_page]
+        return messages, encode_cursor(messages[-1])
+
+    return messages, None
+
+
+def home_query(user_id):
+    """Messages by `user_id` and everyone they follow.
+
+    The followed ids stay in a subquery, so the database resolves them in
+    the same round trip rather than us loading them and sending back an IN
+    list with an entry per followed user.
+    """
+
+    followed_ids = (select(Follows.user_being_followed_id)
+                    .where(Follows.user_following_id == user_id))
+    return Message.query.filter(or_(Message.user_id == user_id,
+                                    Message.user_id.in_(followed_ids)))
+
+
+def user_messages_query(user_id):
+    """Messages written by `user_id`."""
+
+    return Message.query.filter(Message.user_id == user_id)
+
+
+def liked_messages_query(user_id):
+    """Messages liked by `user_id`; page it in LIKED_ORDER."""
+
+    return (Message
+            .query
+            .join(Likes, Likes.message_id == Message.id)
+            .filter(Likes.user_id == user_id))
+
+
+def messages_by_ids(message_ids):
+    """Load messages with the given ids, keeping the order of `message_ids`."""
+
+    query = with_authors(Message.query).filter(Message.id.in_(message_ids))
+    by_id = {msg.id: msg for msg in query}
+    return [by_id[msg_id] for msg_id in message_ids if msg_id in by_id]
+
+
+def liked_ids(user_id, messages):
+    """Set of ids of the `messages` that `user_id` has liked.
+
+    Only looks up the messages on the page, so it costs the same however
+    many likes the user has made over time.
+    """
+
+    message_ids = [msg.id for msg in messages]
+    if not message_ids:
+        return set()
+
+    return set(db.session.scalars(
+        select(Likes.message_id)
+        .where(Likes.user_id == user_id, Likes.message_id.in_(message_ids))))
+
+
+def like_counts(messages):
+    """Dict of message id -> number of likes, for the `messages` on a page.
+
+    One grouped COUNT over the likes index on message_id, however many
+    messages there are; messages nobody has liked are left out.
+    """
+
+    message_ids = [msg.id for msg in messages]
+    if not message_ids:
+        return {}
+
+    return dict(db.session.execute(
+        select(Likes.message_id, func.count())
+        .where(Likes.message_id.in_(message_ids))
+        .group_by(Likes.message_id)).all())
+
+
+def get_message_or_404(message_id):
+    """Load one message (and its author), or abort with a 404."""
+
+    return (with_authors(Message.query)
+            .filter(Message.id == message_id)
+            .first_or_404())
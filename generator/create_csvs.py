@@ -2,15 +2,49 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows:
+
+    python generator/create_csvs.py --users 1000000 --messages 10000000 \\
+        --follows 50000000
+
+It runs offline, and in memory proportional to BATCH_SIZE rather than to
+the size of the dataset: ids, timestamps and picks from pools of Faker text
+are drawn with NumPy a batch at a time, and follows are sampled per block of
+followers without ever listing every possible pair.
+
+With --shards, each CSV is split into that many shard files (e.g.
+users-0003.csv), generated in parallel by --workers processes, and with
+--gzip they're compressed (users-0003.csv.gz). Every shard has its own
+random stream derived from --seed, so the same --seed, --shards and --end
+always give the same files, however many workers made them. Shards of
+users.csv hold consecutive id ranges; load them in name order (loader.py
+does).
+
+--profile picks how skewed the data is (see PROFILES): 'uniform' spreads
+follows and messages evenly; 'zipf' gives power-law follower counts, users
+who follow thousands and a few prolific posters; 'celebrity' adds accounts
+that a large share of all follows point at; 'bursty' bunches posting into
+short bursts. Use them to benchmark feeds, follower pages and counters
+against hot spots.
+
+Messages and follows refer to users by row number in users.csv (from 1),
+the ids they get when loaded into an empty users table, as seed.py does.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import gzip
+import os
+from datetime import datetime
+from functools import lru_cache, partial
+from multiprocessing import Pool
+
+import numpy as np
 from faker import Faker
-from helpers import get_random_datetime
+
+from helpers import (read_header_image_urls, time_window, format_timestamps,
+                     add_bursts, zipf_cdf, draw_ids, cap_degrees,
+                     target_weights, sample_pairs)
 
 MAX_WARBLER_LENGTH = 140
 
@@ -20,11 +54,49 @@ FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+NUM_FOLLOWS = 5000
 
-fake = Faker()
+# Rows generated (and held in memory) at a time
+BATCH_SIZE = 100_000
 
-# Generate random profile image URLs to use for users
+# Separate random streams (with the seed and shard number) for each CSV
+STREAMS = {'users': 0, 'messages': 1, 'follows': 2, 'degrees': 3,
+           'workload': 4}
+
+# Workload profiles: how skewed the generated data is.
+#   follower_zipf    Zipf exponent of users' follower counts (0: uniform)
+#   following_sigma  lognormal sigma of how many users each user follows
+#                    (0: about the same for everyone)
+#   celebrities      accounts getting celebrity_share of all follows
+#   author_zipf      Zipf exponent of how many messages users post
+#   burst_share      share of messages posted in one of `bursts` bursts,
+#                    each about burst_hours long
+PROFILE_DEFAULTS = dict(follower_zipf=0, following_sigma=0, celebrities=0,
+                        celebrity_share=0, author_zipf=0, burst_share=0,
+                        bursts=0, burst_hours=0)
+
+PROFILES = {
+    'uniform': {},
+    'zipf': dict(follower_zipf=1.0, following_sigma=1.5, author_zipf=1.0),
+    'celebrity': dict(follower_zipf=1.0, following_sigma=1.5,
+                      author_zipf=1.0, celebrities=10, celebrity_share=0.3),
+    'bursty': dict(author_zipf=1.0, burst_share=0.5, bursts=50,
+                   burst_hours=2),
+}
+
+CSV_HEADERS = {
+    'users': USERS_CSV_HEADERS,
+    'messages': MESSAGES_CSV_HEADERS,
+    'follows': FOLLOWS_CSV_HEADERS,
+}
+
+# Distinct Faker values of each kind to pick from; calling Faker per row
+# would dominate the run time
+POOL_SIZE = 1000
+
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+# Random profile image URLs to use for users
 
 image_urls = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
@@ -32,46 +104,230 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
 
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
+@lru_cache
+def make_pools(seed):
+    """Lists of fake names, email domains, sentences etc. to pick from."""
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
+    Faker.seed(seed)
+    fake = Faker()
+    return dict(
+        usernames=[fake.user_name() for _ in range(POOL_SIZE)],
+        domains=[fake.free_email_domain() for _ in range(POOL_SIZE)],
+        bios=[fake.sentence() for _ in range(POOL_SIZE)],
+        locations=[fake.city() for _ in range(POOL_SIZE)],
+        texts=[fake.paragraph()[:MAX_WARBLER_LENGTH]
+               for _ in range(POOL_SIZE)],
+        image_urls=image_urls,
+        header_image_urls=read_header_image_urls(),
+    )
+
+
+def picks(rng, pool, size):
+    """`size` random items of `pool`."""
+
+    return [pool[i] for i in rng.integers(0, len(pool), size).tolist()]
+
+
+def batches(total, size=BATCH_SIZE):
+    """Yield `(start, count)` for each batch of `total` rows."""
+
+    for start in range(0, total, size):
+        yield start, min(size, total - start)
+
+
+def write_users(writer, rng, pools, first, count):
+    """Users with ids `first + 1` to `first + count`."""
+
+    for start, size in batches(count):
+        # the user id suffix keeps usernames and emails unique
+        ids = range(first + start + 1, first + start + size + 1)
+        usernames = [f"{name}{user_id}" for name, user_id in
+                     zip(picks(rng, pools['usernames'], size), ids)]
+        writer.writerows(zip(
+            [f"{username}@{domain}" for username, domain in
+             zip(usernames, picks(rng, pools['domains'], size))],
+            usernames,
+            picks(rng, pools['image_urls'], size),
+            [PASSWORD] * size,
+            picks(rng, pools['bios'], size),
+            picks(rng, pools['header_image_urls'], size),
+            picks(rng, pools['locations'], size),
         ))
 
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
 
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
+@lru_cache
+def workload(seed, n_users, profile, window):
+    """Popularity distributions, celebrities and bursts for `profile`.
+
+    Every shard worker computes the same ones from their own stream.
+    """
+
+    settings = {**PROFILE_DEFAULTS, **PROFILES[profile]}
+    rng = np.random.default_rng([seed, STREAMS['workload']])
+    celebrities = min(settings['celebrities'], n_users)
+    start, end = window
+
+    follower_cdf = zipf_cdf(rng, n_users, settings['follower_zipf'])
+    author_cdf = zipf_cdf(rng, n_users, settings['author_zipf'])
+    celebrity_ids = rng.choice(n_users, celebrities, replace=False)
+    return dict(
+        settings,
+        follow_weights=target_weights(n_users, follower_cdf, celebrity_ids,
+                                      settings['celebrity_share']),
+        author_cdf=author_cdf,
+        burst_centers=rng.integers(start, end, settings['bursts']),
+    )
+
+
+def write_messages(writer, rng, pools, n_users, count, window, work):
+    for start, size in batches(count):
+        micros = rng.integers(*window, size)
+        if work['bursts']:
+            add_bursts(rng, micros, work['burst_centers'],
+                       work['burst_share'], work['burst_hours'] * 3600e6,
+                       *window)
+        writer.writerows(zip(
+            picks(rng, pools['texts'], size),
+            format_timestamps(micros),
+            (draw_ids(rng, n_users, work['author_cdf'], size) + 1).tolist(),
         ))
 
-# Generate follows.csv from random pairings of users
 
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
+@lru_cache
+def follow_degrees(seed, n_users, n_follows, following_sigma):
+    """How many users each user follows, totalling exactly `n_follows`.
+
+    Every shard worker computes the same array from its own stream.
+    """
+
+    rng = np.random.default_rng([seed, STREAMS['degrees']])
+    if following_sigma:
+        weights = rng.lognormal(0, following_sigma, n_users)
+        weights /= weights.sum()
+    else:
+        weights = np.full(n_users, 1 / n_users)
+    degrees = rng.multinomial(n_follows, weights)
+    return cap_degrees(rng, degrees, n_users - 1)
+
+
+def write_follows(writer, rng, degrees, first, end, work):
+    """Follows made by users `first` to `end - 1` (0-based)."""
+
+    n_users = len(degrees)
+
+    # Blocks of followers with about BATCH_SIZE follows between them
+    cumulative = np.cumsum(degrees[first:end])
+    ends = first + np.searchsorted(
+        cumulative, np.arange(BATCH_SIZE, cumulative[-1], BATCH_SIZE))
+    bounds = [first] + sorted(set(ends.tolist() + [end]))
+    for block_first, block_end in zip(bounds, bounds[1:]):
+        followers, followed = sample_pairs(
+            rng, block_first, degrees[block_first:block_end], n_users,
+            work['follow_weights'])
+        writer.writerows(zip((followed + 1).tolist(),
+                             (followers + 1).tolist()))
+
+
+def split(total, shards):
+    """Bounds of `shards` nearly equal ranges covering 0..total."""
+
+    return np.linspace(0, total, shards + 1).round().astype(int).tolist()
+
+
+def shard_path(args, kind, shard):
+    if args.shards == 1:
+        name = f"{kind}.csv"
+    else:
+        name = f"{kind}-{shard:04d}.csv"
+    if args.gzip:
+        name += '.gz'
+    return os.path.join(args.out, name)
+
+
+def open_csv(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wt', newline='', compresslevel=1)
+    return open(path, 'w', newline='')
+
+
+def generate_shard(args, task):
+    """Write shard `shard` of CSV `kind`; returns its path."""
+
+    kind, shard = task
+    rng = np.random.default_rng([args.seed, STREAMS[kind], shard])
+    pools = make_pools(args.seed)
+    window = time_window(args.end)
+    work = workload(args.seed, args.users, args.profile, window)
+    path = shard_path(args, kind, shard)
+
+    with open_csv(path) as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADERS[kind])
+
+        if kind == 'users':
+            bounds = split(args.users, args.shards)
+            write_users(writer, rng, pools, bounds[shard],
+                        bounds[shard + 1] - bounds[shard])
+
+        elif kind == 'messages':
+            bounds = split(args.messages, args.shards)
+            write_messages(writer, rng, pools, args.users,
+                           bounds[shard + 1] - bounds[shard], window, work)
+
+        else:
+            degrees = follow_degrees(args.seed, args.users, args.follows,
+                                     work['following_sigma'])
+            # shards of followers making about the same number of follows
+            bounds = np.searchsorted(np.cumsum(degrees),
+                                     split(args.follows, args.shards),
+                                     side='right')
+            bounds[0], bounds[-1] = 0, args.users
+            if bounds[shard] < bounds[shard + 1]:
+                write_follows(writer, rng, degrees, bounds[shard],
+                              bounds[shard + 1], work)
+
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate Warbler CSVs.")
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLOWS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--end', type=datetime.fromisoformat,
+                        default=datetime.now().replace(
+                            hour=0, minute=0, second=0, microsecond=0),
+                        help="latest message time (default: today)")
+    parser.add_argument('--out', default='generator',
+                        help="directory to write the CSVs to")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="files to split each CSV into")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes generating shards in parallel")
+    parser.add_argument('--gzip', action='store_true',
+                        help="write gzip-compressed CSVs")
+    parser.add_argument('--profile', choices=PROFILES, default='uniform',
+                        help="how skewed follows and posting are")
+    args = parser.parse_args()
+
+    if args.follows > args.users * (args.users - 1):
+        parser.error(f"{args.users} users can make at most "
+                     f"{args.users * (args.users - 1)} follows")
+
+    tasks = [(kind, shard) for kind in CSV_HEADERS
+             for shard in range(args.shards)]
+    generate = partial(generate_shard, args)
+
+    if args.workers == 1:
+        for path in map(generate, tasks):
+            print(f"Wrote {path}")
+        return
 
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
+    with Pool(args.workers) as pool:
+        for path in pool.imap_unordered(generate, tasks):
+            print(f"Wrote {path}")
 
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+if __name__ == '__main__':
+    main()
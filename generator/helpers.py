@@ -1,14 +1,174 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+import os
+from datetime import datetime, timedelta
 
+import numpy as np
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+# Rounds of drawing follows for a whole block of followers at once before
+# the followers still short of their count pick the rest one by one
+REJECTION_ROUNDS = 4
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+HEADER_IMAGE_URLS_FILE = os.path.join(os.path.dirname(__file__),
+                                      'header_image_urls.txt')
 
-    return datetime.fromtimestamp(random_timestamp)
+
+def read_header_image_urls():
+    """Header image URLs to pick from (a fixed list, so no network needed)."""
+
+    with open(HEADER_IMAGE_URLS_FILE) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def time_window(end, year_gap=2):
+    """`(start, end)` in microseconds since the epoch, `year_gap` years long."""
+
+    start = end.replace(year=end.year - year_gap)
+    epoch = datetime(1970, 1, 1)
+    return ((start - epoch) // timedelta(microseconds=1),
+            (end - epoch) // timedelta(microseconds=1))
+
+
+def format_timestamps(micros):
+    """Format an array of epoch microseconds like `str(datetime)` does."""
+
+    strings = np.datetime_as_string(micros.astype('datetime64[us]'))
+    return [s.replace('T', ' ') for s in strings.tolist()]
+
+
+def add_bursts(rng, micros, centers, share, spread, start, end):
+    """Move about `share` of `micros` into bursts around `centers`.
+
+    Each moved timestamp lands near a random center, normally distributed
+    with standard deviation `spread` (all in microseconds), within
+    [start, end).
+    """
+
+    moved = rng.random(len(micros)) < share
+    count = int(moved.sum())
+    jitter = rng.normal(0, spread, count).astype(np.int64)
+    micros[moved] = np.clip(
+        centers[rng.integers(0, len(centers), count)] + jitter,
+        start, end - 1)
+    return micros
+
+
+def zipf_cdf(rng, n, exponent):
+    """Cumulative Zipf weights (rank ** -exponent) of `n` ids.
+
+    Ranks are dealt out to ids at random, so the most popular users are
+    spread over the id range. None for a uniform distribution (exponent 0).
+    """
+
+    if not exponent:
+        return None
+    weights = np.arange(1, n + 1, dtype=float) ** -exponent
+    cdf = np.cumsum(weights[rng.permutation(n)])
+    return cdf / cdf[-1]
+
+
+def draw_ids(rng, n, cdf, size):
+    """`size` random 0-based ids below `n`, distributed by `cdf` (or uniformly)."""
+
+    if cdf is None:
+        return rng.integers(0, n, size)
+    return np.minimum(np.searchsorted(cdf, rng.random(size), side='right'),
+                      n - 1)
+
+
+def cap_degrees(rng, degrees, cap):
+    """Move counts above `cap` onto other entries that still have room.
+
+    Keeps the total (so the exact number of follows asked for), as long as
+    it's at most `cap * len(degrees)`.
+    """
+
+    degrees = degrees.copy()
+    while True:
+        excess = int(np.maximum(degrees - cap, 0).sum())
+        if not excess:
+            return degrees
+        np.minimum(degrees, cap, out=degrees)
+        room = np.flatnonzero(degrees < cap)
+        degrees[room] += rng.multinomial(excess,
+                                         np.full(len(room), 1 / len(room)))
+
+
+def target_weights(n, cdf, celebrity_ids, celebrity_share):
+    """Chance of each of `n` ids being the target of a follow.
+
+    Follows go by `cdf` (or uniformly), except that `celebrity_share` of
+    them go to a random one of `celebrity_ids`. None if that's uniform.
+    """
+
+    if cdf is None and not len(celebrity_ids):
+        return None
+    if cdf is None:
+        weights = np.full(n, 1 / n)
+    else:
+        weights = np.diff(cdf, prepend=0)
+    if len(celebrity_ids):
+        weights *= 1 - celebrity_share
+        weights[celebrity_ids] += celebrity_share / len(celebrity_ids)
+    return weights
+
+
+def sample_pairs(rng, first_follower, degrees, n_users, weights):
+    """Distinct (follower, followed) pairs for a block of followers.
+
+    The followers are `first_follower`, `first_follower + 1`, ..., and the
+    i-th follows `degrees[i]` of the `n_users` users (0-based), picked by
+    `weights` (or uniformly if None). Returns two arrays (followers,
+    followed), sorted by follower.
+
+    Candidates are first drawn for the whole block at once, and those that
+    repeat a pair or are the follower themself are drawn again, so memory
+    is proportional to the number of pairs, never to `n_users ** 2`. On
+    dense or skewed graphs nearly every candidate repeats, so after
+    REJECTION_ROUNDS the followers still short draw the rest without
+    replacement from the users they don't follow yet.
+    """
+
+    if len(degrees) and degrees.max() > n_users - 1:
+        raise ValueError(f"{n_users} users can each follow at most "
+                         f"{n_users - 1} others")
+
+    cdf = None
+    if weights is not None:
+        cdf = np.cumsum(weights)
+        cdf /= cdf[-1]
+
+    followers = first_follower + np.arange(len(degrees))
+    keys = np.empty(0, dtype=np.int64)
+    short_followers, missing = followers, degrees
+
+    for _ in range(REJECTION_ROUNDS):
+        if not len(short_followers):
+            break
+        candidates = np.repeat(short_followers, missing)
+        targets = draw_ids(rng, n_users, cdf, len(candidates))
+        ok = candidates != targets
+        keys = np.unique(np.concatenate(
+            [keys, candidates[ok] * n_users + targets[ok]]))
+
+        have = np.bincount(keys // n_users - first_follower,
+                           minlength=len(degrees))
+        short = have < degrees
+        short_followers, missing = followers[short], (degrees - have)[short]
+
+    rest = [keys]
+    for follower, count in zip(short_followers.tolist(), missing.tolist()):
+        if weights is None:
+            p = np.ones(n_users)
+        else:
+            p = weights.copy()
+        p[follower] = 0
+        lo, hi = np.searchsorted(keys, [follower * n_users,
+                                        (follower + 1) * n_users])
+        p[keys[lo:hi] % n_users] = 0
+        targets = rng.choice(n_users, size=count, replace=False,
+                             p=p / p.sum())
+        rest.append(follower * n_users + targets)
+    keys = np.sort(np.concatenate(rest))
+
+    return keys // n_users, keys % n_users
@@ -0,0 +1,34 @@
+"""gunicorn settings for Warbler (gunicorn reads this file automatically).
+
+Each worker process serves GUNICORN_THREADS requests at once (gthread
+workers), so a request waiting on bcrypt holds only one of its process's
+threads, and passwords.py's per-process limit on hashing leaves the rest
+for page requests. Also lets /metrics add up every worker's numbers; see
+metrics.py.
+"""
+
+import os
+import shutil
+import tempfile
+
+worker_class = 'gthread'
+# twice the hashes passwords.py allows per process by default
+threads = int(os.environ.get('GUNICORN_THREADS',
+                             max(8, 2 * (os.cpu_count() or 2))))
+
+
+def on_starting(server):
+    """Give the workers an empty directory to keep their metrics in."""
+
+    path = os.environ.setdefault(
+        'PROMETHEUS_MULTIPROC_DIR',
+        os.path.join(tempfile.gettempdir(), 'warbler-metrics'))
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def child_exit(server, worker):
+    """Stop reporting a dead worker's live values."""
+
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,100 @@
+"""Liking and unliking messages.
+
+`toggle_like` flips whether a user likes a message and moves their
+`likes_count` with it, atomically. On Postgres it's one statement: the
+DELETE, an INSERT ... ON CONFLICT DO NOTHING (which runs only if nothing
+was deleted) and the counter UPDATE are CTEs of a single SELECT, so
+concurrent clicks can neither like a message twice nor count a like twice.
+SQLite runs the same steps as separate statements; its first write takes
+the database write lock, so they can't interleave with another toggle.
+
+These are Core statements, so counters.py's Likes events don't fire for
+them; the counter update is part of the toggle instead.
+"""
+
+from sqlalchemy import delete, exists, func, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, User, Message, Likes
+import counters
+
+likes = Likes.__table__
+messages = Message.__table__
+users = User.__table__
+
+INSERTED_COLUMNS = ['user_id', 'message_id', 'message_timestamp']
+
+
+def matching_like(user_id, message_id):
+    return (likes.c.user_id == user_id) & (likes.c.message_id == message_id)
+
+
+def likeable(user_id, message_id):
+    """SELECT of the like to insert, if `user_id` may like `message_id`.
+
+    Returns no row if there's no such message, or it's their own.
+    """
+
+    return (select(literal(user_id), messages.c.id, messages.c.timestamp)
+            .where(messages.c.id == message_id,
+                   messages.c.user_id != user_id))
+
+
+def postgres_toggle(user_id, message_id):
+    """Single statement toggling the like; selects +1, -1 or 0."""
+
+    removed = (delete(likes)
+               .where(matching_like(user_id, message_id))
+               .returning(likes.c.user_id)
+               .cte('removed'))
+    added = (postgresql.insert(likes)
+             .from_select(INSERTED_COLUMNS,
+                          likeable(user_id, message_id)
+                          .where(~exists(select(removed.c.user_id))))
+             .on_conflict_do_nothing()
+             .returning(likes.c.user_id)
+             .cte('added'))
+
+    change = (select(func.count()).select_from(added).scalar_subquery()
+              - select(func.count()).select_from(removed).scalar_subquery())
+    counted = (update(users)
+               .where(users.c.id == user_id, change != 0)
+               .values(likes_count=users.c.likes_count + change)
+               .cte('counted'))
+
+    return select(change).add_cte(counted)
+
+
+def sequential_toggle(connection, user_id, message_id):
+    """Toggle the like with one statement per step; returns +1, -1 or 0."""
+
+    if connection.execute(
+            delete(likes).where(matching_like(user_id, message_id))).rowcount:
+        counters.bump(connection, user_id, likes_count=-1)
+        return -1
+
+    if connection.execute(
+            sqlite.insert(likes)
+            .from_select(INSERTED_COLUMNS, likeable(user_id, message_id))
+            .on_conflict_do_nothing()).rowcount:
+        counters.bump(connection, user_id, likes_count=1)
+        return 1
+
+    return 0
+
+
+def toggle_like(user_id, message_id):
+    """Like `message_id` for `user_id`, or unlike it if they already do.
+
+    Returns True if it's now liked, False if it's now not, or None if
+    nothing changed (no such message, or it's their own). Runs in the
+    session's transaction; the caller commits.
+    """
+
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        change = connection.scalar(postgres_toggle(user_id, message_id))
+    else:
+        change = sequential_toggle(connection, user_id, message_id)
+
+    return {1: True, -1: False}.get(change)
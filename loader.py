@@ -0,0 +1,176 @@
+"""Streaming bulk loader for Warbler's CSV data.
+
+Reads each CSV a chunk of rows at a time and writes every chunk in its own
+transaction, so memory use stays flat however big the file is. Postgres
+gets each chunk through `COPY ... FROM STDIN`; other databases (SQLite)
+through one executemany INSERT per chunk. Both skip the ORM, so nothing
+here fires model events: recount counters after loading (see seed.py).
+
+Secondary indexes are dropped for the duration of a load and rebuilt once
+at the end, which is much faster than updating them row by row. Empty CSV
+fields load as NULL.
+
+A source can be a glob pattern matching several shard files, which load in
+name order, and files ending in .gz are decompressed as they're read (see
+generator/create_csvs.py --shards and --gzip).
+"""
+
+import csv
+import glob
+import gzip
+import io
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import text
+
+from models import db
+import search
+
+CHUNK_SIZE = 20_000
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    """Yield `(columns, rows)` for each chunk of up to `chunk_size` rows."""
+
+    if path.endswith('.gz'):
+        f = gzip.open(path, 'rt', newline='')
+    else:
+        f = open(path, newline='')
+
+    with f:
+        reader = csv.reader(f)
+        columns = next(reader)
+        chunk = []
+        for row in reader:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield columns, chunk
+                chunk = []
+        if chunk:
+            yield columns, chunk
+
+
+def copy_chunk(conn, table, columns, rows):
+    """Write `rows` into `table` with Postgres COPY."""
+
+    quote = conn.dialect.identifier_preparer.quote
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    cursor = conn.connection.cursor()
+    cursor.copy_expert(
+        f"COPY {quote(table.name)} ({', '.join(map(quote, columns))}) "
+        f"FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def insert_chunk(conn, table, columns, rows):
+    """Write `rows` into `table` with one executemany INSERT."""
+
+    quote = conn.dialect.identifier_preparer.quote
+    placeholders = ', '.join('?' for _ in columns)
+    # straight to the driver: the values are already in the database's
+    # text formats, which SQLAlchemy's DateTime type would refuse
+    conn.exec_driver_sql(
+        f"INSERT INTO {quote(table.name)} "
+        f"({', '.join(map(quote, columns))}) VALUES ({placeholders})",
+        [tuple(value if value != '' else None for value in row)
+         for row in rows])
+
+
+def load_csv(table, path, chunk_size=CHUNK_SIZE, echo=print):
+    """Stream CSV file `path` (with a header row) into `table`.
+
+    Returns the number of rows loaded.
+    """
+
+    if db.engine.dialect.name == 'postgresql':
+        write_chunk = copy_chunk
+    else:
+        write_chunk = insert_chunk
+
+    started = time.monotonic()
+    loaded = 0
+    for columns, rows in read_chunks(path, chunk_size):
+        unknown = set(columns) - set(table.columns.keys())
+        if unknown:
+            raise ValueError(f"{path}: no such columns in {table.name}: "
+                             f"{', '.join(sorted(unknown))}")
+
+        with db.engine.begin() as conn:
+            write_chunk(conn, table, columns, rows)
+
+        loaded += len(rows)
+        elapsed = time.monotonic() - started
+        echo(f"{table.name}: {loaded:,} rows "
+             f"({loaded / elapsed:,.0f} rows/s)")
+
+    return loaded
+
+
+def secondary_indexes(tables):
+    """Names of the indexes on `tables` that a load can do without.
+
+    On Postgres that includes the username search indexes, which aren't
+    declared on the model.
+    """
+
+    names = [index.name for table in tables for index in table.indexes]
+    if (db.engine.dialect.name == 'postgresql'
+            and any(table.name == 'users' for table in tables)):
+        names += search.POSTGRES_SEARCH_INDEXES
+    return names
+
+
+@contextmanager
+def deferred_indexes(tables, echo=print):
+    """Drop `tables`' secondary indexes, and rebuild them on the way out."""
+
+    names = secondary_indexes(tables)
+    with db.engine.begin() as conn:
+        for name in names:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+    try:
+        yield
+    finally:
+        started = time.monotonic()
+        with db.engine.begin() as conn:
+            for table in tables:
+                for index in table.indexes:
+                    index.create(conn, checkfirst=True)
+                if (table.name == 'users'
+                        and conn.dialect.name == 'postgresql'):
+                    for statement in search.POSTGRES_SEARCH_DDL:
+                        conn.execute(text(statement))
+        echo(f"Rebuilt {len(names)} indexes "
+             f"in {time.monotonic() - started:.1f}s")
+
+
+def expand(pattern):
+    """Paths matching glob `pattern`, in name order."""
+
+    paths = sorted(glob.glob(pattern))
+    if not paths:
+        raise FileNotFoundError(f"No files match {pattern}")
+    return paths
+
+
+def load_files(sources, chunk_size=CHUNK_SIZE, echo=print):
+    """Load `sources`, a list of (table name, CSV path or glob), in order.
+
+    Put parent tables first (users before the messages that point at them).
+    """
+
+    tables = [db.metadata.tables[name] for name in dict(sources)]
+    with deferred_indexes(tables, echo):
+        for name, pattern in sources:
+            for path in expand(pattern):
+                echo(f"Loading {path}")
+                load_csv(db.metadata.tables[name], path, chunk_size, echo)
+
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.begin() as conn:
+            for table in tables:
+                conn.execute(text(f"ANALYZE {table.name}"))
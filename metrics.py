@@ -0,0 +1,152 @@
+"""Prometheus metrics for Warbler, served at /metrics.
+
+For each endpoint it records request latency, how many SQL statements each
+request ran, and how long those statements took. SQL is timed with the
+engine's cursor events, so Core statements count as well as ORM ones. It
+also records bcrypt time: each hash or check, including any wait for a
+free hashing thread (see passwords.py).
+
+A request's timing ends when its response is closed. A streamed page
+therefore includes the queries it runs while it renders.
+
+The numbers give away how the site is used, so /metrics only exists when
+METRICS_ENABLED is set, and only answers scrapers that send
+`Authorization: Bearer <METRICS_TOKEN>`.
+
+Under gunicorn each worker process keeps its own numbers. Set
+PROMETHEUS_MULTIPROC_DIR before the app is imported (gunicorn.conf.py
+does this). prometheus_client then keeps every worker's numbers in files
+in that directory, and /metrics adds them up, whichever worker serves it.
+"""
+
+import hmac
+import os
+import threading
+import time
+from functools import partial
+
+from flask import request, has_request_context, current_app
+from prometheus_client import (CollectorRegistry, Counter, Histogram,
+                               REGISTRY, CONTENT_TYPE_LATEST, generate_latest,
+                               multiprocess)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Requests not routed to any view (404s) are labelled with this endpoint
+NO_ENDPOINT = 'none'
+
+QUERY_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 25, 50, 100)
+
+REQUESTS = Counter(
+    'warbler_requests', "Requests handled.",
+    ['endpoint', 'method', 'status'])
+REQUEST_SECONDS = Histogram(
+    'warbler_request_seconds',
+    "Time to handle a request, until its response is closed.",
+    ['endpoint'])
+REQUEST_QUERIES = Histogram(
+    'warbler_request_queries', "SQL statements run per request.",
+    ['endpoint'], buckets=QUERY_BUCKETS)
+REQUEST_SQL_SECONDS = Histogram(
+    'warbler_request_sql_seconds', "Time spent running SQL per request.",
+    ['endpoint'])
+BCRYPT_SECONDS = Histogram(
+    'warbler_bcrypt_seconds',
+    "Time to hash or check a password, including waiting for a thread.",
+    ['endpoint', 'operation'])
+
+
+class RequestTally:
+    """What one request has done so far."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+
+
+class Metrics:
+    """Records request, SQL and bcrypt timings for an app.
+
+    SQL is only counted while this thread is handling a request, so
+    background work (e.g. write-behind flushes) isn't charged to one.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        event.listen(Engine, 'before_cursor_execute', self.before_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_execute)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', False)
+        app.config.setdefault('METRICS_TOKEN', None)
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        if app.config['METRICS_ENABLED']:
+            if not app.config['METRICS_TOKEN']:
+                raise RuntimeError("METRICS_ENABLED needs a METRICS_TOKEN")
+            app.add_url_rule('/metrics', 'metrics', self.view)
+
+    def before_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        self.local.query_started = time.perf_counter()
+
+    def after_execute(self, conn, cursor, statement, parameters, context,
+                      executemany):
+        tally = getattr(self.local, 'tally', None)
+        if tally is not None:
+            tally.queries += 1
+            tally.sql_seconds += (time.perf_counter()
+                                  - self.local.query_started)
+
+    def start_request(self):
+        if request.endpoint == 'metrics':
+            self.local.tally = None
+        else:
+            self.local.tally = RequestTally()
+
+    def finish_request(self, response):
+        tally = getattr(self.local, 'tally', None)
+        if tally is not None:
+            response.call_on_close(partial(
+                self.record, tally, request.endpoint or NO_ENDPOINT,
+                request.method, response.status_code))
+        return response
+
+    def record(self, tally, endpoint, method, status):
+        if getattr(self.local, 'tally', None) is tally:
+            self.local.tally = None
+
+        REQUESTS.labels(endpoint, method, status).inc()
+        REQUEST_SECONDS.labels(endpoint).observe(
+            time.perf_counter() - tally.started)
+        REQUEST_QUERIES.labels(endpoint).observe(tally.queries)
+        REQUEST_SQL_SECONDS.labels(endpoint).observe(tally.sql_seconds)
+
+    def observe_bcrypt(self, operation, seconds):
+        """Record a bcrypt `operation` ('hash' or 'check') that took `seconds`."""
+
+        if has_request_context():
+            endpoint = request.endpoint or NO_ENDPOINT
+        else:
+            endpoint = NO_ENDPOINT
+        BCRYPT_SECONDS.labels(endpoint, operation).observe(seconds)
+
+    def view(self):
+        """Show all metrics, in Prometheus's text format."""
+
+        token = current_app.config['METRICS_TOKEN']
+        sent = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(sent.encode(),
+                                   f"Bearer {token}".encode()):
+            return "", 401, {'WWW-Authenticate': 'Bearer'}
+
+        if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return generate_latest(registry), {'Content-Type': CONTENT_TYPE_LATEST}
+
+
+metrics = Metrics()
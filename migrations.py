@@ -0,0 +1,206 @@
+"""Versioned schema migrations for Warbler.
+
+`db.create_all()` only creates missing tables; it won't add an index or
+column to a table that already exists (like one loaded from warbler.sql).
+Each migration here is a function that brings an existing database up to
+the next version; applied versions are recorded in `schema_migrations`.
+
+Run from the project directory:
+
+    python migrations.py status     # show applied and pending migrations
+    python migrations.py upgrade    # apply pending migrations
+    python migrations.py stamp      # mark all as applied (fresh create_all)
+"""
+
+import sys
+from datetime import datetime
+
+from sqlalchemy import text
+
+from models import db
+import counters
+import search
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register the decorated function as migration number `version`.
+
+    The function gets a connection inside the migration's transaction.
+    """
+
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+
+    return register
+
+
+##############################################################################
+# Migrations (append new ones at the end; never edit one that has shipped)
+
+
+@migration(1, "Composite indexes for feed, following and likes lookups")
+def add_hot_query_indexes(conn):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_messages_user_id_timestamp_id "
+        "ON messages (user_id, timestamp, id)"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_follows_following_followed "
+        "ON follows (user_following_id, user_being_followed_id)"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_likes_user_id_message_id "
+        "ON likes (user_id, message_id)"))
+
+
+@migration(2, "Denormalized message/follow/like counters on users")
+def add_user_counters(conn):
+    for column in counters.COUNTERS:
+        conn.execute(text(
+            f"ALTER TABLE users ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0"))
+    counters.recount(connection=conn)
+
+
+@migration(3, "Trigram and prefix indexes for username search (Postgres)")
+def add_username_search_indexes(conn):
+    if conn.dialect.name != 'postgresql':
+        return  # other databases search with search.UsernameIndex
+    # replaced by migration 6
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+        "ON users USING gin (lower(username) gin_trgm_ops)"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_users_username_prefix "
+        "ON users (lower(username) text_pattern_ops)"))
+
+
+@migration(4, "Liked message timestamps on likes, for the likes page")
+def add_likes_message_timestamp(conn):
+    conn.execute(text(
+        "ALTER TABLE likes ADD COLUMN message_timestamp TIMESTAMP"))
+    conn.execute(text(
+        "UPDATE likes SET message_timestamp = "
+        "(SELECT timestamp FROM messages WHERE messages.id = likes.message_id)"))
+    if conn.dialect.name == 'postgresql':
+        # SQLite can't add NOT NULL to an existing column
+        conn.execute(text(
+            "ALTER TABLE likes ALTER COLUMN message_timestamp SET NOT NULL"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_likes_user_id_message_timestamp_id "
+        "ON likes (user_id, message_timestamp, message_id)"))
+
+
+@migration(5, "Likes keyed by (user_id, message_id); many users per message")
+def rekey_likes(conn):
+    # Neither database can swap a table's primary key in place (SQLite
+    # can't drop the unique constraint either), so copy into a new table.
+    conn.execute(text(
+        "CREATE TABLE likes_new ("
+        "user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE, "
+        "message_id INTEGER NOT NULL "
+        "REFERENCES messages (id) ON DELETE CASCADE, "
+        "message_timestamp TIMESTAMP NOT NULL, "
+        "PRIMARY KEY (user_id, message_id))"))
+    conn.execute(text(
+        "INSERT INTO likes_new (user_id, message_id, message_timestamp) "
+        "SELECT DISTINCT user_id, message_id, message_timestamp FROM likes "
+        "WHERE user_id IS NOT NULL AND message_id IS NOT NULL"))
+    conn.execute(text("DROP TABLE likes"))
+    conn.execute(text("ALTER TABLE likes_new RENAME TO likes"))
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text(
+            "ALTER TABLE likes RENAME CONSTRAINT likes_new_pkey TO likes_pkey"))
+    conn.execute(text(
+        "CREATE INDEX ix_likes_message_id ON likes (message_id)"))
+    conn.execute(text(
+        "CREATE INDEX ix_likes_user_id_message_timestamp_id "
+        "ON likes (user_id, message_timestamp, message_id)"))
+
+
+@migration(6, "Username search indexes that page in order (Postgres)")
+def reindex_username_search(conn):
+    if conn.dialect.name != 'postgresql':
+        return
+    # GiST (unlike GIN) returns trigram matches nearest first, and a "C"
+    # collation btree serves LIKE 'q%' and ORDER BY lower(username) alike
+    conn.execute(text("DROP INDEX IF EXISTS ix_users_username_trgm"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_users_username_prefix"))
+    for statement in search.POSTGRES_SEARCH_DDL:
+        conn.execute(text(statement))
+
+
+##############################################################################
+# Applying migrations
+
+
+def ensure_version_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "description TEXT NOT NULL, "
+        "applied_at TIMESTAMP NOT NULL)"))
+
+
+def applied_versions():
+    """Set of migration versions already applied to the database."""
+
+    with db.engine.begin() as conn:
+        ensure_version_table(conn)
+        rows = conn.execute(text("SELECT version FROM schema_migrations"))
+        return {version for (version,) in rows}
+
+
+def pending_migrations():
+    applied = applied_versions()
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+
+def record(conn, version, description):
+    conn.execute(
+        text("INSERT INTO schema_migrations (version, description, applied_at) "
+             "VALUES (:version, :description, :applied_at)"),
+        dict(version=version, description=description,
+             applied_at=datetime.utcnow()))
+
+
+def upgrade(echo=print):
+    """Apply pending migrations in order, each in its own transaction."""
+
+    for version, description, fn in pending_migrations():
+        echo(f"Applying {version}: {description}")
+        with db.engine.begin() as conn:
+            fn(conn)
+            record(conn, version, description)
+
+
+def stamp():
+    """Mark every migration as applied, without running it.
+
+    For a database just built by `db.create_all()`, which already has the
+    current schema.
+    """
+
+    pending = pending_migrations()
+    with db.engine.begin() as conn:
+        for version, description, fn in pending:
+            record(conn, version, description)
+
+
+def status(echo=print):
+    applied = applied_versions()
+    for version, description, fn in MIGRATIONS:
+        state = 'applied' if version in applied else 'pending'
+        echo(f"{version:>4}  {state:<8} {description}")
+
+
+if __name__ == '__main__':
+    import app  # noqa: F401 (connects db and pushes an app context)
+
+    commands = {'status': status, 'upgrade': upgrade, 'stamp': stamp}
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    if command not in commands:
+        sys.exit(f"usage: python migrations.py [{'|'.join(commands)}]")
+    commands[command]()
@@ -2,10 +2,11 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, select
+
+from passwords import hasher
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
 
 
@@ -14,6 +15,13 @@ class Follows(db.Model):
 
     __tablename__ = 'follows'
 
+    # The primary key covers "who follows X"; this covers "who does X
+    # follow" (the home feed and following page).
+    __table_args__ = (
+        db.Index('ix_follows_following_followed',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
     user_being_followed_id = db.Column(
         db.Integer,
         db.ForeignKey('users.id', ondelete="cascade"),
@@ -27,25 +35,46 @@ class Follows(db.Model):
     )
 
 
+def liked_message_timestamp(context):
+    """Default for Likes.message_timestamp: look up the liked message's."""
+
+    message_id = context.get_current_parameters()['message_id']
+    return context.connection.scalar(
+        select(Message.timestamp).where(Message.id == message_id))
+
+
 class Likes(db.Model):
     """Mapping user likes to warbles."""
 
-    __tablename__ = 'likes' 
+    __tablename__ = 'likes'
 
-    id = db.Column(
-        db.Integer,
-        primary_key=True
+    # The primary key covers "has X liked these messages" (and makes a
+    # second like of the same message a conflict); the indexes cover "who
+    # liked this message" and the likes page, newest liked message first.
+    __table_args__ = (
+        db.Index('ix_likes_message_id', 'message_id'),
+        db.Index('ix_likes_user_id_message_timestamp_id',
+                 'user_id', 'message_timestamp', 'message_id'),
     )
 
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete='cascade')
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
     )
 
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        primary_key=True,
+    )
+
+    # Copy of the liked message's timestamp (which never changes), so the
+    # likes page can be ordered without joining every liked message.
+    message_timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=liked_message_timestamp,
     )
 
 
@@ -94,6 +123,36 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Denormalized counts, maintained by counters.py
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     messages = db.relationship('Message')
 
     followers = db.relationship(
@@ -119,17 +178,33 @@ class User(db.Model):
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
+    @property
+    def following_ids(self):
+        """Set of ids of the users this user follows.
+
+        Loaded with one query the first time it's needed and then kept
+        until the instance is expired (e.g. by a commit), like a loaded
+        relationship would be. Templates that check follow status for
+        every card on a page use this rather than scanning `following`.
+        """
+
+        ids = self.__dict__.get('_following_ids')
+        if ids is None:
+            ids = set(db.session.scalars(
+                select(Follows.user_being_followed_id)
+                .where(Follows.user_following_id == self.id)))
+            self.__dict__['_following_ids'] = ids
+        return ids
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return self.id in other_user.following_ids
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.id in self.following_ids
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -138,7 +213,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -159,23 +234,42 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash was made with a different bcrypt cost than the
+        one configured now, it's replaced with a fresh hash (the caller
+        commits).
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
 
 
+@event.listens_for(User, 'expire')
+def forget_following_ids(user, attrs):
+    # user is None if the instance was garbage collected while expired
+    if user is not None:
+        user.__dict__.pop('_following_ids', None)
+
+
 class Message(db.Model):
     """An individual message ("warble")."""
 
     __tablename__ = 'messages'
 
+    # Feeds filter on author and page newest first by (timestamp, id).
+    __table_args__ = (
+        db.Index('ix_messages_user_id_timestamp_id',
+                 'user_id', 'timestamp', 'id'),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -189,7 +283,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
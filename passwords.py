@@ -0,0 +1,102 @@
+"""Password hashing for Warbler.
+
+bcrypt is deliberately slow, so hashing runs on a small pool of worker
+threads (bcrypt releases the GIL while it works). At most
+PASSWORD_HASH_WORKERS hashes run at once, and at most PASSWORD_HASH_QUEUE
+more wait their turn; past that, callers get PasswordHasherBusy straight
+away rather than queueing behind a login burst while page requests starve
+for CPU.
+
+The request thread still waits for its hash, and the limits apply per
+process. They only protect page requests when each process serves several
+requests at once, so gunicorn.conf.py runs gthread workers with
+GUNICORN_THREADS threads each. Keep PASSWORD_HASH_WORKERS plus
+PASSWORD_HASH_QUEUE (by default, the CPU count) below that, so a login
+burst can't take every thread. With sync workers, one request per process,
+the limit never trips.
+
+The cost factor is BCRYPT_LOG_ROUNDS. Hashes made with a different cost
+still verify; `User.authenticate` rehashes them at the configured cost on
+the next successful login. Time spent hashing is recorded in metrics.py.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask_bcrypt import Bcrypt
+
+from metrics import metrics
+from profiler import profiler
+
+DEFAULT_ROUNDS = 12
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many hashes are already running or queued."""
+
+
+class PasswordHasher:
+    """Runs bcrypt hashing and checking on a bounded thread pool.
+
+    Until `init_app` configures it, it hashes inline at the default cost.
+    """
+
+    def __init__(self):
+        self.bcrypt = Bcrypt()
+        self.rounds = DEFAULT_ROUNDS
+        self.executor = None
+        self.slots = None
+
+    def init_app(self, app):
+        self.rounds = app.config.setdefault('BCRYPT_LOG_ROUNDS',
+                                            DEFAULT_ROUNDS)
+        workers = app.config.setdefault('PASSWORD_HASH_WORKERS',
+                                        max((os.cpu_count() or 2) // 2, 1))
+        queue = app.config.setdefault('PASSWORD_HASH_QUEUE', workers)
+
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='bcrypt')
+        self.slots = threading.BoundedSemaphore(workers + queue)
+
+    def _run(self, operation, fn, *args):
+        started = time.perf_counter()
+        if self.executor is None:
+            result = fn(*args)
+        elif not self.slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        else:
+            try:
+                result = self.executor.submit(profiler.carry(fn),
+                                              *args).result()
+            finally:
+                self.slots.release()
+
+        metrics.observe_bcrypt(operation, time.perf_counter() - started)
+        return result
+
+    def hash(self, password):
+        """Return a bcrypt hash of `password` at the configured cost."""
+
+        hashed = self._run('hash', self.bcrypt.generate_password_hash,
+                           password, self.rounds)
+        return hashed.decode('UTF-8')
+
+    def check(self, hashed, password):
+        """Does `password` match bcrypt hash `hashed`?"""
+
+        return self._run('check', self.bcrypt.check_password_hash, hashed,
+                         password)
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made with a cost other than the configured one?"""
+
+        # bcrypt hashes look like $2b$12$<salt and hash>
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+
+hasher = PasswordHasher()
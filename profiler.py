@@ -0,0 +1,313 @@
+"""On-demand sampling profiler for single requests.
+
+A request is profiled when one of these asks for it:
+
+- it carries an `X-Profile` header with a token signed with the app's
+  SECRET_KEY. `flask profile token` makes one, valid for an hour, e.g.:
+
+      curl -H "X-Profile: $(flask profile token)" -b session=... /
+
+- an admin has toggled profiling for the user making it: `flask profile
+  user 42 --endpoint homepage --requests 3` profiles user 42's next three
+  homepage requests, and `flask profile clear` turns the toggles off.
+  Toggles live in the cache, so workers only see them if CACHE_URL is
+  shared (a file:// cache); with the default per-process cache these
+  commands refuse to run.
+
+While a profiled request runs, a sampler thread records the request
+thread's Python stack every PROFILE_INTERVAL seconds. Sampling carries on
+until the response is closed, so a streamed page's template rendering is
+included. bcrypt runs on the password hashing threads (see passwords.py),
+so while the request waits for it, samples show the hashing thread's stack
+in place of the wait.
+
+The profile is saved in PROFILE_DIR in the "folded stacks" format that
+flamegraph.pl and speedscope read, one `frame;frame;...;frame count` line
+per distinct stack. The response's X-Profile-Output header names the file.
+Jinja templates show up as frames in the template files, and ORM row
+loading as frames in sqlalchemy/orm/loading.py.
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+import click
+from flask import request, current_app
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+from cache import cache
+
+DEFAULT_INTERVAL = 0.005
+DEFAULT_MAX_SECONDS = 60
+TOKEN_MAX_AGE = 3600
+TOGGLES_KEY = 'profile:toggles'
+
+# How often each process re-reads the admin toggles from the cache
+TOGGLES_POLL_SECONDS = 1
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def frame_name(code):
+    """Flame graph label for a frame running `code`."""
+
+    filename = code.co_filename
+    if 'site-packages' + os.sep in filename:
+        filename = filename.rsplit('site-packages' + os.sep, 1)[1]
+    elif filename.startswith(ROOT + os.sep):
+        filename = os.path.relpath(filename, ROOT)
+    else:
+        filename = os.path.basename(filename)
+    return f"{filename}:{code.co_qualname}"
+
+
+def fold(frame, stop_at=None):
+    """`frame`'s stack, outermost first, as `a;b;c` (up to code `stop_at`)."""
+
+    names = []
+    while frame is not None and frame.f_code is not stop_at:
+        names.append(frame_name(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Profile:
+    """Samples one request thread's stack until stopped."""
+
+    def __init__(self, thread_id, interval, max_seconds):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.deadline = time.monotonic() + max_seconds
+        self.counts = Counter()
+        self.helpers = {}
+        self.done = threading.Event()
+        self.sampler = threading.Thread(target=self._sample,
+                                        name='profiler', daemon=True)
+        self.sampler.start()
+
+    def _sample(self):
+        while (not self.done.wait(self.interval)
+               and time.monotonic() < self.deadline):
+            frames = sys._current_frames()
+            frame = frames.get(self.thread_id)
+            if frame is None:
+                continue
+
+            stack = fold(frame)
+            for helper_id, (caller, stop_at) in list(self.helpers.items()):
+                helper_frame = frames.get(helper_id)
+                if helper_frame is None:
+                    continue
+                # the helper's stack replaces the request's wait for it
+                while frame is not None and frame.f_code is not caller:
+                    frame = frame.f_back
+                stack = fold(frame) + ';' + fold(helper_frame, stop_at)
+            self.counts[stack] += 1
+
+    def stop(self):
+        """Stop sampling; return the folded stacks text."""
+
+        self.done.set()
+        self.sampler.join()
+        return ''.join(f"{stack} {count}\n"
+                       for stack, count in self.counts.most_common())
+
+
+def carried(profile, fn, caller):
+    """Wrap `fn` so that, on whichever thread runs it, `profile` samples it.
+
+    `caller` is the code that hands `fn` over and waits for it.
+    """
+
+    def run_carried(*args):
+        profile.helpers[threading.get_ident()] = (caller,
+                                                  run_carried.__code__)
+        try:
+            return fn(*args)
+        finally:
+            profile.helpers.pop(threading.get_ident(), None)
+    return run_carried
+
+
+class Profiler:
+    """Decides which requests to profile, and profiles them."""
+
+    def __init__(self):
+        self.app = None
+        self.user_id = lambda: None
+        self.active = {}
+        self._toggles = {}
+        self._toggles_read_at = 0
+
+    def init_app(self, app, user_id):
+        """Hook into `app`; `user_id()` says who's making the request."""
+
+        self.app = app
+        self.user_id = user_id
+        app.config.setdefault('PROFILE_INTERVAL', DEFAULT_INTERVAL)
+        app.config.setdefault('PROFILE_MAX_SECONDS', DEFAULT_MAX_SECONDS)
+        app.config.setdefault('PROFILE_DIR', os.path.join(
+            tempfile.gettempdir(), 'warbler-profiles'))
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.cli.add_command(profile_command)
+
+    def serializer(self):
+        return URLSafeTimedSerializer(self.app.config['SECRET_KEY'],
+                                      salt='profile')
+
+    def make_token(self):
+        """A token for the X-Profile header."""
+
+        return self.serializer().dumps('profile')
+
+    def has_valid_token(self):
+        token = request.headers.get('X-Profile')
+        if not token:
+            return False
+        try:
+            self.serializer().loads(token, max_age=TOKEN_MAX_AGE)
+        except BadSignature:
+            return False
+        return True
+
+    def toggles(self):
+        """{user id (str): {'endpoint', 'remaining'}}, re-read every second."""
+
+        if time.monotonic() - self._toggles_read_at > TOGGLES_POLL_SECONDS:
+            self._toggles = cache.get(TOGGLES_KEY) or {}
+            self._toggles_read_at = time.monotonic()
+        return self._toggles
+
+    def take_toggle(self, user_id):
+        """Use up one of `user_id`'s toggled requests to this endpoint."""
+
+        key = str(user_id)
+        toggle = self.toggles().get(key)
+        if not toggle or toggle['endpoint'] not in (None, request.endpoint):
+            return False
+
+        taken = []
+
+        def use(toggles):
+            toggle = toggles.get(key)
+            if toggle and toggle['remaining'] > 0:
+                toggle['remaining'] -= 1
+                taken.append(True)
+                if not toggle['remaining']:
+                    del toggles[key]
+            return toggles
+
+        self._toggles = cache.update(TOGGLES_KEY, use) or {}
+        return bool(taken)
+
+    def wanted(self):
+        if self.has_valid_token():
+            return True
+        user_id = self.user_id()
+        return user_id is not None and self.take_toggle(user_id)
+
+    def start_request(self):
+        if self.wanted():
+            thread_id = threading.get_ident()
+            self.active[thread_id] = Profile(
+                thread_id, self.app.config['PROFILE_INTERVAL'],
+                self.app.config['PROFILE_MAX_SECONDS'])
+
+    def finish_request(self, response):
+        thread_id = threading.get_ident()
+        profile = self.active.get(thread_id)
+        if profile is None:
+            return response
+
+        path = os.path.join(
+            self.app.config['PROFILE_DIR'],
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint}-"
+            f"{uuid.uuid4().hex[:8]}.folded")
+        response.headers['X-Profile-Output'] = os.path.basename(path)
+
+        def save():
+            if self.active.get(thread_id) is profile:
+                del self.active[thread_id]
+            folded = profile.stop()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(folded)
+
+        response.call_on_close(save)
+        return response
+
+    def carry(self, fn):
+        """`fn`, sampled on the thread that runs it if this request is profiled.
+
+        For work a request hands to another thread and waits for.
+        """
+
+        profile = self.active.get(threading.get_ident())
+        if profile is None:
+            return fn
+        return carried(profile, fn, sys._getframe(1).f_code)
+
+
+def profile_user(user_id, endpoint=None, requests=1):
+    """Profile `user_id`'s next `requests` requests (to `endpoint`)."""
+
+    def add(toggles):
+        toggles = dict(toggles or {})
+        toggles[str(user_id)] = {'endpoint': endpoint,
+                                 'remaining': requests}
+        return toggles
+
+    if cache.update(TOGGLES_KEY, add) is None:
+        cache.set(TOGGLES_KEY, add({}))
+
+
+@click.group('profile')
+def profile_command():
+    """Profile single requests; see profiler.py."""
+
+
+def require_shared_cache():
+    """Fail unless toggles set here will reach the server's workers."""
+
+    if not cache.shared:
+        raise click.UsageError(
+            "Profiling toggles live in the cache, which is per-process with "
+            "CACHE_URL=memory://; set CACHE_URL to a file:// cache shared "
+            "with the server (or use `flask profile token`).")
+
+
+@profile_command.command('token')
+def token_command():
+    """Print a token for the X-Profile header (valid for an hour)."""
+
+    click.echo(profiler.make_token())
+
+
+@profile_command.command('user')
+@click.argument('user_id', type=int)
+@click.option('--endpoint', help="only requests to this view, e.g. homepage")
+@click.option('--requests', default=1, help="how many requests to profile")
+def user_command(user_id, endpoint, requests):
+    """Profile a user's next requests."""
+
+    require_shared_cache()
+    profile_user(user_id, endpoint, requests)
+    click.echo(f"Profiling {requests} request(s) by user {user_id}; "
+               f"profiles go to {current_app.config['PROFILE_DIR']}")
+
+
+@profile_command.command('clear')
+def clear_command():
+    """Stop profiling users' requests."""
+
+    require_shared_cache()
+    cache.delete(TOGGLES_KEY)
+
+
+profiler = Profiler()
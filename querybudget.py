@@ -0,0 +1,81 @@
+"""Query budgets, to catch views that start running too much SQL.
+
+Each view in app.py declares the most SQL statements a request to it may
+run with `@query_budget(n)`. That counts everything the request runs: the
+before-request hooks, the view itself, and the lazy loads that templates
+trigger while they render. A template edit that adds a query per row of a
+page (an N+1) then goes over budget. test_querybudget.py requests every
+view and checks it stays within budget. The check doesn't run in
+production.
+
+`count_queries()` is also handy on its own in tests.
+"""
+
+import re
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from models import db
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when code runs more SQL statements than its budget allows."""
+
+    def __init__(self, what, budget, statements):
+        listing = '\n'.join(f"  {number}. {compact(statement)}"
+                            for number, statement in enumerate(statements, 1))
+        super().__init__(f"{what} ran {len(statements)} queries, over its "
+                         f"budget of {budget}:\n{listing}")
+        self.budget = budget
+        self.statements = statements
+
+
+def compact(statement):
+    """`statement` on one line, for reporting."""
+
+    return re.sub(r'\s+', ' ', statement).strip()
+
+
+@contextmanager
+def count_queries():
+    """Collect the SQL statements run inside the `with` block."""
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@contextmanager
+def max_queries(budget, what="Block"):
+    """Raise QueryBudgetExceeded if the `with` block runs over `budget`."""
+
+    with count_queries() as statements:
+        yield statements
+    if len(statements) > budget:
+        raise QueryBudgetExceeded(what, budget, statements)
+
+
+def query_budget(budget):
+    """Declare that a request to the decorated view runs at most `budget` queries.
+
+    Put it under `@app.route`.
+    """
+
+    def decorator(view):
+        view.query_budget = budget
+        return view
+    return decorator
+
+
+def budget_of(view):
+    """The budget `view` declared, or None."""
+
+    return getattr(view, 'query_budget', None)
@@ -0,0 +1,120 @@
+"""Query plans for Warbler's hot queries.
+
+Prints the database's plan for the query behind each busy route, so a
+missing or unused index shows up as a sequential scan before it shows up
+as a slow page. Run from the project directory:
+
+    python queryplans.py
+
+On Postgres, run it against a database with realistic data: for
+near-empty tables the planner rightly prefers a sequential scan.
+test_queryplans.py checks the same plans use the expected indexes, so it
+turns sequential scans (and sorts, where a page must need none) off for
+the EXPLAIN; that way a plan only scans the table if no index can serve
+the query.
+"""
+
+from datetime import datetime
+
+from models import db, User, Follows
+import feeds
+
+# A cursor somewhere in the middle of a feed, so the seek is part of the plan
+SAMPLE_CURSOR = (datetime(2020, 1, 1), 1000)
+
+SAMPLE_USER_ID = 1
+
+
+def hot_queries(user_id=SAMPLE_USER_ID):
+    """Return {name: (query, index it should use)} for each hot query.
+
+    The index is None where the primary key is enough.
+    """
+
+    return {
+        'home feed': (
+            feeds.page_query(feeds.home_query(user_id), SAMPLE_CURSOR),
+            'ix_messages_user_id_timestamp_id'),
+        'profile messages': (
+            feeds.page_query(feeds.user_messages_query(user_id),
+                             SAMPLE_CURSOR),
+            'ix_messages_user_id_timestamp_id'),
+        'likes': (
+            feeds.page_query(feeds.liked_messages_query(user_id),
+                             SAMPLE_CURSOR, order=feeds.LIKED_ORDER),
+            'ix_likes_user_id_message_timestamp_id'),
+        'following': (
+            User.query.join(Follows,
+                            Follows.user_being_followed_id == User.id)
+                      .filter(Follows.user_following_id == user_id),
+            'ix_follows_following_followed'),
+        'followers': (
+            User.query.join(Follows, Follows.user_following_id == User.id)
+                      .filter(Follows.user_being_followed_id == user_id),
+            None),
+    }
+
+
+def explain(query, disable=()):
+    """Return the database's plan for ORM `query`, as a list of lines.
+
+    On Postgres, the planner methods named in `disable` (e.g. 'seqscan')
+    are turned off for the EXPLAIN.
+    """
+
+    dialect = db.engine.dialect
+    compiled = query.statement.compile(
+        dialect=dialect, compile_kwargs={'render_postcompile': True})
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+
+    if dialect.name == 'postgresql':
+        prefix = 'EXPLAIN '
+    else:
+        prefix = 'EXPLAIN QUERY PLAN '
+        disable = ()
+
+    with db.engine.connect() as conn:
+        for method in disable:
+            conn.exec_driver_sql(f"SET LOCAL enable_{method} = off")
+        rows = conn.exec_driver_sql(prefix + str(compiled), params)
+        return [row[-1] for row in rows]
+
+
+def is_full_scan(line):
+    """Does plan `line` read a whole table?"""
+
+    return ((line.startswith('SCAN ') and 'INDEX' not in line)
+            or 'Seq Scan' in line)
+
+
+def plan_problems(user_id=SAMPLE_USER_ID, disable=()):
+    """Return a description of each hot query whose plan looks wrong."""
+
+    problems = []
+    for name, (query, index) in hot_queries(user_id).items():
+        plan = explain(query, disable)
+        text = '\n'.join(plan)
+        if any(is_full_scan(line) for line in plan):
+            problems.append(f"{name}: full table scan\n{text}")
+        elif index and index not in text:
+            problems.append(f"{name}: doesn't use {index}\n{text}")
+    return problems
+
+
+def print_plans(user_id=SAMPLE_USER_ID):
+    for name, (query, index) in hot_queries(user_id).items():
+        print(f"== {name} (expects {index or 'primary key'})")
+        for line in explain(query):
+            print(f"   {line}")
+        print()
+
+    for problem in plan_problems(user_id):
+        print(f"PROBLEM: {problem}")
+
+
+if __name__ == '__main__':
+    import app  # noqa: F401 (connects db and pushes an app context)
+
+    print_plans()
@@ -0,0 +1,254 @@
+"""Username search for Warbler.
+
+Queries shorter than MIN_SUBSTRING_LENGTH match username prefixes, listed
+in (lowercase, byte-wise) username order, which puts an exact match first.
+Longer queries match usernames containing them, most similar first. Either
+way a page costs about the same however many users match:
+
+- prefix pages are a range scan of an index on lower(username), and the
+  cursor for the next page is the last (username, id) shown;
+- substring pages are read off a trigram index nearest-first (KNN), and
+  the cursor is how many results have been shown, up to
+  MAX_SUBSTRING_RESULTS; past that, narrow the query.
+
+On Postgres those are the indexes in POSTGRES_SEARCH_DDL: a GiST pg_trgm
+index and a btree in the "C" collation, which serves both LIKE 'q%' and
+the ordering (see migration 6). Other databases (SQLite in tests and
+development) use UsernameIndex, an in-process sorted list plus trigram map
+that is rebuilt whenever users change.
+"""
+
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+from sqlalchemy import DDL, event, func, select, tuple_
+from sqlalchemy.orm import Session
+
+from models import db, User
+
+RESULTS_PER_PAGE = 24
+
+MIN_SUBSTRING_LENGTH = 3
+
+# Most substring matches paged through, so deep pages stay cheap
+MAX_SUBSTRING_RESULTS = 240
+
+# Longest a process will trust its in-memory index; covers users added by
+# other processes, which don't trigger this process's invalidation.
+INDEX_MAX_AGE = 60
+
+# Run by migration 6, and when create_all makes the users table
+POSTGRES_SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_users_username_trgm_gist "
+    "ON users USING gist (lower(username) gist_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_username_c "
+    "ON users ((lower(username) COLLATE \"C\"), id)",
+]
+
+POSTGRES_SEARCH_INDEXES = ['ix_users_username_trgm_gist',
+                           'ix_users_username_c']
+
+for statement in POSTGRES_SEARCH_DDL:
+    event.listen(User.__table__, 'after_create',
+                 DDL(statement).execute_if(dialect='postgresql'))
+
+
+def trigrams(text):
+    """Set of 3-character substrings of `text`."""
+
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def similarity(a, b):
+    """Trigram similarity of two strings, like pg_trgm's similarity()."""
+
+    a, b = trigrams(a), trigrams(b)
+    if not a or not b:
+        return 0
+    return len(a & b) / len(a | b)
+
+
+def rank(entry, q):
+    """Sort key ranking `(lowercase username, id)` as a substring match."""
+
+    username, user_id = entry
+    return (-similarity(username, q), username, user_id)
+
+
+class UsernameIndex:
+    """In-process index of usernames for databases without pg_trgm."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built_at = None
+        self._sorted = []      # [(lower username, id)], sorted
+        self._trigrams = {}    # trigram -> set of indexes into _sorted
+
+    def invalidate(self):
+        self._built_at = None
+
+    def _ensure_built(self):
+        with self._lock:
+            if (self._built_at is not None
+                    and time.monotonic() - self._built_at < INDEX_MAX_AGE):
+                return
+
+            rows = db.session.execute(select(func.lower(User.username),
+                                             User.id))
+            entries = sorted(rows.tuples())
+            grams = {}
+            for i, (username, _) in enumerate(entries):
+                for gram in trigrams(username):
+                    grams.setdefault(gram, set()).add(i)
+
+            self._sorted, self._trigrams = entries, grams
+            self._built_at = time.monotonic()
+
+    def prefix_matches(self, q, after, limit):
+        """Up to `limit` (username, id) starting with `q`, after `after`."""
+
+        self._ensure_built()
+        entries = self._sorted
+        if after:
+            i = bisect_right(entries, after)
+        else:
+            i = bisect_left(entries, (q,))
+
+        matches = []
+        while (len(matches) < limit and i < len(entries)
+               and entries[i][0].startswith(q)):
+            matches.append(entries[i])
+            i += 1
+        return matches
+
+    def substring_matches(self, q, offset, limit):
+        """Up to `limit` (username, id) containing `q`, from `offset`."""
+
+        self._ensure_built()
+        candidates = None
+        for gram in trigrams(q):
+            found = self._trigrams.get(gram, set())
+            candidates = found if candidates is None else candidates & found
+            if not candidates:
+                return []
+        matches = [self._sorted[i] for i in candidates
+                   if q in self._sorted[i][0]]
+        matches.sort(key=lambda entry: rank(entry, q))
+        return matches[offset:offset + limit]
+
+
+username_index = UsernameIndex()
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def user_changed(mapper, connection, user):
+    username_index.invalidate()
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def users_bulk_changed(orm_execute_state):
+    if (not orm_execute_state.is_select
+            and any(mapper.class_ is User
+                    for mapper in orm_execute_state.all_mappers)):
+        username_index.invalidate()
+
+
+def escape_like(text):
+    """Escape LIKE wildcards in `text`, using '!' as the escape character."""
+
+    return (text.replace('!', '!!')
+                .replace('%', '!%')
+                .replace('_', '!_'))
+
+
+def postgres_prefix_matches(q, after, limit):
+    """Up to `limit` (username, id) starting with `q`, after `after`.
+
+    A range scan of ix_users_username_c, already in order.
+    """
+
+    username = func.lower(User.username).collate('C')
+    stmt = (select(username, User.id)
+            .where(username.like(f"{escape_like(q)}%", escape='!'))
+            .order_by(username, User.id)
+            .limit(limit))
+    if after:
+        stmt = stmt.where(tuple_(username, User.id) > tuple_(*after))
+    return list(db.session.execute(stmt).tuples())
+
+
+def postgres_substring_matches(q, offset, limit):
+    """Up to `limit` (username, id) containing `q`, from `offset`.
+
+    Nearest first off ix_users_username_trgm_gist, so only the rows shown
+    (and those skipped) are read, not every match.
+    """
+
+    username = func.lower(User.username)
+    stmt = (select(username, User.id)
+            .where(username.like(f"%{escape_like(q)}%", escape='!'))
+            .order_by(username.op('<->')(q), username, User.id)
+            .offset(offset)
+            .limit(limit))
+    return list(db.session.execute(stmt).tuples())
+
+
+def decode_prefix_cursor(after):
+    """`(username, id)` from a prefix-search cursor `id:username`."""
+
+    user_id, username = after.split(':', 1)
+    return username, int(user_id)
+
+
+def decode_substring_cursor(after):
+    """Number of results shown, from a substring-search cursor."""
+
+    offset = int(after)
+    if offset < 0:
+        raise ValueError(f"Bad search cursor: {after}")
+    return offset
+
+
+def search_users(q, after=None, per_page=RESULTS_PER_PAGE):
+    """Return `(users, next_cursor)` for the page of matches for `q`.
+
+    `after` is the previous page's cursor; next_cursor is None on the last
+    page. Raises ValueError for a malformed cursor.
+    """
+
+    q = q.lower()
+    postgres = db.engine.dialect.name == 'postgresql'
+    next_cursor = None
+
+    if len(q) < MIN_SUBSTRING_LENGTH:
+        if postgres:
+            find = postgres_prefix_matches
+        else:
+            find = username_index.prefix_matches
+        matches = find(q, decode_prefix_cursor(after) if after else None,
+                       per_page + 1)
+        if len(matches) > per_page:
+            matches = matches[:per_page]
+            username, user_id = matches[-1]
+            next_cursor = f"{user_id}:{username}"
+
+    else:
+        if postgres:
+            find = postgres_substring_matches
+        else:
+            find = username_index.substring_matches
+        offset = decode_substring_cursor(after) if after else 0
+        limit = max(min(per_page, MAX_SUBSTRING_RESULTS - offset), 0)
+        matches = find(q, offset, limit + 1) if limit else []
+        if len(matches) > limit:
+            matches = matches[:limit]
+            if offset + limit < MAX_SUBSTRING_RESULTS:
+                next_cursor = str(offset + limit)
+
+    ids = [user_id for _, user_id in matches]
+    by_id = {user.id: user for user in User.query.filter(User.id.in_(ids))}
+    return [by_id[user_id] for user_id in ids if user_id in by_id], next_cursor
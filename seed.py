@@ -1,20 +1,29 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
+
+    python seed.py              # the sample data in generator/
+    python seed.py DIRECTORY    # CSVs (or shards, maybe gzipped) made by
+                                # generator/create_csvs.py --out DIRECTORY
+"""
+
+import os
+import sys
 
-from csv import DictReader
 from app import db
-from models import User, Message, Follows
+import counters
+import loader
+import migrations
+
+data_dir = sys.argv[1] if len(sys.argv) > 1 else 'generator'
 
+# users.csv, or shards users-0000.csv.gz, users-0001.csv.gz, ...
+SEED_FILES = [(table, os.path.join(data_dir, f'{table}*.csv*'))
+              for table in ('users', 'messages', 'follows')]
 
 db.drop_all()
 db.create_all()
+migrations.stamp()
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
-
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
-
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
+loader.load_files(SEED_FILES)
 
-db.session.commit()
+# the loader skips the ORM events that maintain counters
+counters.recount_all()
@@ -0,0 +1,190 @@
+"""Slow-query log.
+
+Any SQL statement that takes longer than SLOW_QUERY_THRESHOLD seconds is
+logged as a warning on the app's logger. The entry gives:
+
+- the statement, normalized: whitespace collapsed, literals replaced by
+  `?`, and an expanded `IN (...)` list shortened to one entry
+- the shape of its parameters, i.e. their types but not their values
+- the Flask endpoint that ran it
+
+Slow queries of the same kind, such as the home feed's `IN` query with
+different follow lists, therefore log identically and are easy to group.
+
+On Postgres, a share (SLOW_QUERY_EXPLAIN_RATE) of slow SELECTs are run
+again under `EXPLAIN (ANALYZE, BUFFERS)`, and the plan is logged along with
+the statement. The plan shows whether the query read an index or scanned
+the table, and how much came from disk. Other statements are never re-run,
+since EXPLAIN ANALYZE actually executes what it explains.
+
+The re-run never happens on the request thread: slow queries tend to come
+when the pool is short of connections, and the re-run takes as long as the
+slow query did. Each process hands it to a background thread with its own
+one-connection engine, which gives up on a connection after
+EXPLAIN_POOL_TIMEOUT seconds and on the plan after
+SLOW_QUERY_EXPLAIN_TIMEOUT. Entries waiting for a plan are logged once it
+arrives; if EXPLAIN_QUEUE_SIZE are already waiting, they're logged at once
+without one.
+"""
+
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+from flask import request, has_request_context
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+
+DEFAULT_THRESHOLD = 0.5
+DEFAULT_EXPLAIN_RATE = 0.1
+DEFAULT_EXPLAIN_TIMEOUT = 5
+EXPLAIN_POOL_TIMEOUT = 1
+EXPLAIN_QUEUE_SIZE = 10
+
+PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|:\w+)"
+PLACEHOLDER_LIST = re.compile(
+    rf"\(\s*{PLACEHOLDER}(?:\s*,\s*{PLACEHOLDER})+\s*\)")
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r"(?<![\w.])\d+(?:\.\d+)?\b")
+
+
+def normalize(statement):
+    """`statement` with its literals and IN lists abstracted away."""
+
+    statement = STRING.sub('?', statement)
+    statement = NUMBER.sub('?', statement)
+    statement = PLACEHOLDER_LIST.sub('(?, ...)', statement)
+    return re.sub(r'\s+', ' ', statement).strip()
+
+
+def shape(parameters, executemany=False):
+    """Types of `parameters`, e.g. "(int ×3, str)", without their values."""
+
+    if executemany:
+        if not parameters:
+            return "no rows"
+        return f"{len(parameters)} rows of {shape(parameters[0])}"
+
+    if isinstance(parameters, dict):
+        values = parameters.values()
+    else:
+        values = parameters or ()
+
+    runs = []
+    for value in values:
+        name = type(value).__name__
+        if runs and runs[-1][0] == name:
+            runs[-1][1] += 1
+        else:
+            runs.append([name, 1])
+    return '(' + ', '.join(name if count == 1 else f"{name} ×{count}"
+                           for name, count in runs) + ')'
+
+
+def explain_engine(url, timeout):
+    """A one-connection engine whose statements stop after `timeout` s."""
+
+    options = f"-c statement_timeout={int(timeout * 1000)}"
+    return create_engine(
+        url, pool_size=1, max_overflow=0, pool_timeout=EXPLAIN_POOL_TIMEOUT,
+        connect_args={'options': options})
+
+
+def explain(engine, statement, parameters):
+    """Run `statement` under EXPLAIN (ANALYZE, BUFFERS); return the plan."""
+
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters)
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        raw.rollback()
+        raw.close()
+
+
+class SlowQueryLog:
+    """Times every statement and logs the slow ones."""
+
+    def __init__(self):
+        self.app = None
+        self.threshold = None
+        self.explain_rate = 0
+        self.explain_timeout = DEFAULT_EXPLAIN_TIMEOUT
+        self.local = threading.local()
+        self._explains = queue.Queue(EXPLAIN_QUEUE_SIZE)
+        self._engine = None
+        self._thread_pid = None
+        self._lock = threading.Lock()
+        event.listen(Engine, 'before_cursor_execute', self.before_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_execute)
+
+    def init_app(self, app):
+        self.app = app
+        self.threshold = app.config.setdefault('SLOW_QUERY_THRESHOLD',
+                                               DEFAULT_THRESHOLD)
+        self.explain_rate = app.config.setdefault('SLOW_QUERY_EXPLAIN_RATE',
+                                                  DEFAULT_EXPLAIN_RATE)
+        self.explain_timeout = app.config.setdefault(
+            'SLOW_QUERY_EXPLAIN_TIMEOUT', DEFAULT_EXPLAIN_TIMEOUT)
+
+    def before_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        self.local.started = time.perf_counter()
+
+    def after_execute(self, conn, cursor, statement, parameters, context,
+                      executemany):
+        elapsed = time.perf_counter() - self.local.started
+        if self.threshold is None or elapsed < self.threshold:
+            return
+
+        if has_request_context():
+            endpoint = request.endpoint
+        else:
+            endpoint = None
+
+        lines = [f"Slow query ({elapsed:.3f}s) in {endpoint or '-'}: "
+                 f"{normalize(statement)}",
+                 f"  parameters: {shape(parameters, executemany)}"]
+
+        if (conn.dialect.name == 'postgresql' and not executemany
+                and statement.lstrip()[:6].upper() == 'SELECT'
+                and random.random() < self.explain_rate):
+            self._ensure_thread(conn.engine.url)
+            try:
+                self._explains.put_nowait((lines, statement, parameters))
+                return
+            except queue.Full:
+                lines.append("  plan skipped: too many waiting")
+
+        self.app.logger.warning('\n'.join(lines))
+
+    def _ensure_thread(self, url):
+        # Started on first use, so each forked worker gets its own
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid != os.getpid():
+                self._thread_pid = os.getpid()
+                self._engine = explain_engine(url, self.explain_timeout)
+                threading.Thread(target=self._run, name='slow-query-explain',
+                                 daemon=True).start()
+
+    def _run(self):
+        while True:
+            lines, statement, parameters = self._explains.get()
+            try:
+                plan = explain(self._engine, statement, parameters)
+            except Exception as error:
+                lines.append(f"  plan unavailable: {error}")
+            else:
+                lines.append("  plan:")
+                lines += [f"    {line}" for line in plan]
+            self.app.logger.warning('\n'.join(lines))
+            self._explains.task_done()
+
+
+slow_queries = SlowQueryLog()
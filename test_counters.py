@@ -0,0 +1,77 @@
+"""User counter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_counters.py
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message
+import counters
+from testcase import DatabaseTestCase
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CounterTestCase(DatabaseTestCase):
+    """Test that write paths keep user counters in step with the tables."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.alice = User(email="alice@test.com", username="alice",
+                          password="HASHED_PASSWORD")
+        self.bob = User(email="bob@test.com", username="bob",
+                        password="HASHED_PASSWORD")
+        db.session.add_all([self.alice, self.bob])
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def counts(self, user):
+        db.session.refresh(user)
+        return [getattr(user, name) for name in counters.COUNTERS]
+
+    def assertCountsMatchRecount(self):
+        before = [self.counts(u) for u in (self.alice, self.bob)]
+        counters.recount()
+        db.session.commit()
+        after = [self.counts(u) for u in (self.alice, self.bob)]
+        self.assertEqual(before, after)
+
+    def test_write_paths(self):
+        alice_id, bob_id = self.alice.id, self.bob.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = alice_id
+            c.post("/messages/new", data={"text": "Hi"})
+            c.post("/messages/new", data={"text": "Hi again"})
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = bob_id
+            c.post(f"/users/follow/{alice_id}")
+            c.post(f"/users/follow/{alice_id}")  # already following
+            msg_id = Message.query.first().id
+            c.post(f"/users/add_like/{msg_id}")
+
+            # messages, following, followers, likes
+            self.assertEqual(self.counts(self.alice), [2, 0, 1, 0])
+            self.assertEqual(self.counts(self.bob), [0, 1, 0, 1])
+            self.assertCountsMatchRecount()
+
+            html = c.get(f"/users/{alice_id}").data.decode()
+            self.assertIn(f'<a href="/users/{alice_id}">2</a>', html)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = alice_id
+            c.post(f"/messages/{msg_id}/delete")
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = bob_id
+            c.post(f"/users/stop-following/{alice_id}")
+
+            self.assertEqual(self.counts(self.alice), [1, 0, 0, 0])
+            self.assertEqual(self.counts(self.bob), [0, 0, 0, 0])
+            self.assertCountsMatchRecount()
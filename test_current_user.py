@@ -0,0 +1,86 @@
+"""Current user loading tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_current_user.py
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message
+from passwords import hasher
+from querybudget import count_queries
+from testcase import DatabaseTestCase
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CurrentUserTestCase(DatabaseTestCase):
+    """Test the cached display fields of the logged-in user."""
+
+    def setUp(self):
+        super().setUp()
+        self.rounds = hasher.rounds
+        hasher.rounds = 4
+        self.user = User.signup(username="alice", email="alice@test.com",
+                                password="abc123", image_url=None)
+        db.session.commit()
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user.id
+
+    def tearDown(self):
+        hasher.rounds = self.rounds
+        super().tearDown()
+
+    def test_no_queries_when_cached(self):
+        self.client.get("/messages/new")
+
+        with count_queries() as statements:
+            resp = self.client.get("/messages/new")
+        self.assertIn('alt="alice"', resp.data.decode())
+        self.assertEqual(statements, [])
+
+    def test_static_skips_user(self):
+        with count_queries() as statements:
+            resp = self.client.get("/static/stylesheets/style.css")
+        resp.close()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(statements, [])
+
+    def test_full_row_on_demand(self):
+        resp = self.client.get("/")
+        self.assertIn(f'href="/users/{self.user.id}/following">0<',
+                      resp.data.decode())
+
+    def test_profile_invalidates(self):
+        self.client.get("/messages/new")
+        self.client.post("/users/profile", data={
+            "username": "alice2", "email": "alice@test.com",
+            "password": "abc123"})
+
+        html = self.client.get("/messages/new").data.decode()
+        self.assertIn('alt="alice2"', html)
+
+    def test_delete_invalidates(self):
+        self.client.get("/messages/new")
+        self.client.post("/users/delete")
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user.id
+        html = self.client.get("/").data.decode()
+        self.assertNotIn('alt="alice"', html)
+
+    def test_deleted_elsewhere_logs_out(self):
+        self.client.get("/messages/new")
+        # another worker deletes the account; this one's cache still has it
+        User.query.filter_by(id=self.user.id).delete()
+        db.session.commit()
+
+        resp = self.client.post("/messages/new", data={"text": "Hello"})
+        self.assertEqual(resp.status_code, 302)
+        with self.client.session_transaction() as sess:
+            self.assertNotIn(CURR_USER_KEY, sess)
+        html = self.client.get("/").data.decode()
+        self.assertNotIn('alt="alice"', html)
+        self.assertEqual(Message.query.count(), 0)
@@ -0,0 +1,275 @@
+"""Feed pagination tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_feeds.py
+
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from sqlalchemy import insert
+
+from app import app, CURR_USER_KEY
+from cache import cache
+from models import db, User, Message, Follows, Likes
+import feeds
+from querybudget import count_queries, max_queries
+import timelines
+from testcase import DatabaseTestCase
+
+db.create_all()
+
+
+class FeedPaginationTestCase(DatabaseTestCase):
+    """Test cursor pagination of feeds."""
+
+    def setUp(self):
+        """Create a user with 25 messages; the newest 5 share a timestamp."""
+
+        super().setUp()
+
+        self.user = User(email="test@test.com", username="testuser",
+                         password="HASHED_PASSWORD")
+        db.session.add(self.user)
+        db.session.commit()
+
+        start = datetime(2020, 1, 1)
+        for i in range(25):
+            db.session.add(Message(text=f"msg {i}", user_id=self.user.id,
+                                   timestamp=start + timedelta(hours=min(i, 20))))
+        db.session.commit()
+
+        self.newest_first = [msg.id for msg in
+                             Message.query.order_by(Message.timestamp.desc(),
+                                                    Message.id.desc())]
+        self.client = app.test_client()
+
+    def walk(self, next_page):
+        """Collect message ids from every page `next_page(before)` returns."""
+
+        ids, before = [], None
+        while True:
+            messages, cursor = next_page(before)
+            ids.extend(msg.id for msg in messages)
+            if not cursor:
+                return ids
+            before = feeds.decode_cursor(cursor)
+
+    def test_paginate(self):
+        query = feeds.user_messages_query(self.user.id)
+        ids = self.walk(lambda before: feeds.paginate(query, before, 7))
+        self.assertEqual(ids, self.newest_first)
+
+    def test_paginate_likes(self):
+        other = User(email="other@test.com", username="other",
+                     password="HASHED_PASSWORD")
+        db.session.add(other)
+        db.session.commit()
+        # like them out of order; the page is still newest message first
+        db.session.add_all([Likes(user_id=other.id, message_id=msg_id)
+                            for msg_id in sorted(self.newest_first)])
+        db.session.commit()
+
+        query = feeds.liked_messages_query(other.id)
+        ids = self.walk(lambda before: feeds.paginate(
+            query, before, 7, order=feeds.LIKED_ORDER))
+        self.assertEqual(ids, self.newest_first)
+
+    def test_home_page_cache_and_fallback(self):
+        ids = self.walk(
+            lambda before: timelines.home_page(self.user.id, before, 7))
+        self.assertEqual(ids, self.newest_first)
+
+        # With the cached window cut short, later pages come from the db
+        timeline = cache.get(timelines.timeline_key(self.user.id))
+        cache.set(timelines.timeline_key(self.user.id),
+                  {'complete': False, 'entries': timeline['entries'][-10:]})
+        ids = self.walk(
+            lambda before: timelines.home_page(self.user.id, before, 7))
+        self.assertEqual(ids, self.newest_first)
+
+    def test_liked_ids(self):
+        other = User(email="other@test.com", username="other",
+                     password="HASHED_PASSWORD")
+        db.session.add(other)
+        db.session.commit()
+        db.session.add_all([Likes(user_id=other.id, message_id=msg_id)
+                            for msg_id in self.newest_first[::2]])
+        db.session.commit()
+
+        query = feeds.user_messages_query(self.user.id)
+        messages, cursor = feeds.paginate(query, None, 5)
+        self.assertEqual(feeds.liked_ids(other.id, messages),
+                         set(self.newest_first[0:5:2]))
+        self.assertEqual(feeds.liked_ids(self.user.id, messages), set())
+        self.assertEqual(feeds.liked_ids(other.id, []), set())
+
+    def test_like_counts(self):
+        others = [User(email=f"other{i}@test.com", username=f"other{i}",
+                       password="HASHED_PASSWORD") for i in range(3)]
+        db.session.add_all(others)
+        db.session.commit()
+        db.session.add_all([Likes(user_id=other.id, message_id=msg_id)
+                            for i, other in enumerate(others)
+                            for msg_id in self.newest_first[:i + 1]])
+        db.session.commit()
+
+        messages, cursor = feeds.paginate(
+            feeds.user_messages_query(self.user.id), None, 5)
+        first, second, third = self.newest_first[:3]
+        self.assertEqual(feeds.like_counts(messages),
+                         {first: 3, second: 2, third: 1})
+        self.assertEqual(feeds.like_counts([]), {})
+
+        html = self.client.get(f"/users/{self.user.id}").data.decode()
+        self.assertEqual(html.count('<i class="fa fa-thumbs-up"></i>\n'
+                                    '          3</span'), 1)
+
+    def test_load_more_link(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user.id
+
+            html = c.get(f"/users/{self.user.id}").data.decode()
+            self.assertNotIn('Load more', html)
+
+            resp = c.get(f"/users/{self.user.id}?before=garbage")
+            self.assertEqual(resp.status_code, 400)
+
+            shown, older = [db.session.get(Message, msg_id)
+                            for msg_id in self.newest_first[3:5]]
+            html = c.get(f"/users/{self.user.id}?before="
+                         f"{feeds.encode_cursor(shown)}").data.decode()
+            self.assertNotIn(f'<p>{shown.text}</p>', html)
+            self.assertIn(f'<p>{older.text}</p>', html)
+
+
+class LargeFollowingTestCase(DatabaseTestCase):
+    """Test the home feed for a user following 10,000 others."""
+
+    NUM_FOLLOWED = 10_000
+
+    def setUp(self):
+        super().setUp()
+
+        db.session.execute(insert(User), [
+            dict(id=i, email=f"user{i}@test.com", username=f"user{i}",
+                 password="HASHED_PASSWORD")
+            for i in range(1, self.NUM_FOLLOWED + 2)])
+        db.session.execute(insert(Follows), [
+            dict(user_being_followed_id=i, user_following_id=1)
+            for i in range(2, self.NUM_FOLLOWED + 2)])
+        start = datetime(2020, 1, 1)
+        db.session.execute(insert(Message), [
+            dict(text=f"msg {i}", user_id=i % (self.NUM_FOLLOWED + 1) + 1,
+                 timestamp=start + timedelta(minutes=i))
+            for i in range(20_000)])
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def test_home_feed_is_one_query(self):
+        with count_queries() as statements:
+            start = perf_counter()
+            messages, cursor = feeds.paginate(feeds.home_query(1))
+            elapsed = perf_counter() - start
+
+        self.assertEqual(len(statements), 1)
+        self.assertIn('FROM follows', statements[0])
+        self.assertEqual(len(messages), feeds.MESSAGES_PER_PAGE)
+        self.assertEqual(messages[0].text, "msg 19999")
+        self.assertLess(elapsed, 0.5)
+
+    def test_following_page_is_linear(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            with max_queries(4, "following page"):
+                start = perf_counter()
+                resp = c.get("/users/1/following")
+                elapsed = perf_counter() - start
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertLess(elapsed, 2.5)
+
+    def test_timeline_rebuild_is_one_query(self):
+        with count_queries() as statements:
+            start = perf_counter()
+            timelines.rebuild_timeline(1)
+            elapsed = perf_counter() - start
+
+        self.assertEqual(len(statements), 1)
+        self.assertLess(elapsed, 0.5)
+
+
+class FeedQueryCountTestCase(DatabaseTestCase):
+    """Test that rendering a feed page takes a fixed number of queries."""
+
+    def setUp(self):
+        """Bob follows Alice."""
+
+        super().setUp()
+
+        self.alice = User(email="alice@test.com", username="alice",
+                          password="HASHED_PASSWORD")
+        self.bob = User(email="bob@test.com", username="bob",
+                        password="HASHED_PASSWORD")
+        db.session.add_all([self.alice, self.bob])
+        db.session.commit()
+        db.session.add(Follows(user_being_followed_id=self.alice.id,
+                               user_following_id=self.bob.id))
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def add_messages(self, count):
+        """Add `count` messages by Alice and one each by `count` new users.
+
+        Bob follows half the new users, and likes every message.
+        """
+
+        authors = [User(email=f"{n}@test.com", username=n,
+                        password="HASHED_PASSWORD")
+                   for n in (f"author{User.query.count() + i}"
+                             for i in range(count))]
+        db.session.add_all(authors)
+        db.session.commit()
+
+        messages = [Message(text="Hi", user_id=user.id)
+                    for user in [self.alice] * count + authors]
+        db.session.add_all(messages)
+        db.session.add_all([Follows(user_being_followed_id=user.id,
+                                    user_following_id=self.bob.id)
+                            for user in authors[::2]])
+        db.session.commit()
+        db.session.add_all([Likes(user_id=self.bob.id, message_id=msg.id)
+                            for msg in messages])
+        db.session.commit()
+        cache.clear()
+
+    def queries_for(self, url):
+        """Number of queries to render `url` (after a warm-up request)."""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.bob.id
+            self.assertEqual(c.get(url).status_code, 200)
+
+            db.session.expunge_all()
+            with count_queries() as statements:
+                c.get(url)
+            return len(statements)
+
+    def test_query_count_is_fixed(self):
+        urls = ["/", f"/users/{self.alice.id}", f"/users/{self.bob.id}/likes"]
+
+        self.add_messages(3)
+        msg_id = Message.query.first().id
+        urls.append(f"/messages/{msg_id}")
+        few = [self.queries_for(url) for url in urls]
+
+        self.add_messages(30)
+        many = [self.queries_for(url) for url in urls]
+
+        self.assertEqual(few, many)
@@ -0,0 +1,90 @@
+"""Like toggle tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_likes.py
+
+import threading
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Likes
+from likes import toggle_like
+from testcase import DatabaseTestCase
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class LikeToggleTestCase(DatabaseTestCase):
+    """Test liking and unliking messages."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.alice, self.bob, self.carol = [
+            User(email=f"{name}@test.com", username=name,
+                 password="HASHED_PASSWORD")
+            for name in ("alice", "bob", "carol")]
+        db.session.add_all([self.alice, self.bob, self.carol])
+        db.session.commit()
+
+        self.msg = Message(text="hello", user_id=self.alice.id)
+        db.session.add(self.msg)
+        db.session.commit()
+        self.client = app.test_client()
+
+    def likers(self):
+        return {like.user_id for like in
+                Likes.query.filter_by(message_id=self.msg.id)}
+
+    def test_toggle(self):
+        self.assertIs(toggle_like(self.bob.id, self.msg.id), True)
+        self.assertIs(toggle_like(self.carol.id, self.msg.id), True)
+        db.session.commit()
+        self.assertEqual(self.likers(), {self.bob.id, self.carol.id})
+
+        like = db.session.get(Likes, (self.bob.id, self.msg.id))
+        self.assertEqual(like.message_timestamp, self.msg.timestamp)
+
+        self.assertIs(toggle_like(self.bob.id, self.msg.id), False)
+        db.session.commit()
+        self.assertEqual(self.likers(), {self.carol.id})
+
+        db.session.expire_all()
+        self.assertEqual(self.bob.likes_count, 0)
+        self.assertEqual(self.carol.likes_count, 1)
+
+    def test_own_or_missing_message(self):
+        self.assertIsNone(toggle_like(self.alice.id, self.msg.id))
+        self.assertIsNone(toggle_like(self.bob.id, self.msg.id + 1))
+        db.session.commit()
+        self.assertEqual(self.likers(), set())
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.bob.id
+        resp = self.client.post(f"/users/add_like/{self.msg.id + 1}")
+        self.assertEqual(resp.status_code, 404)
+
+        resp = self.client.post(f"/users/add_like/{self.msg.id}")
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(self.likers(), {self.bob.id})
+
+    def test_concurrent_toggles(self):
+        """An even number of toggles leaves things as they were."""
+
+        def toggle_many():
+            with app.app_context():
+                for _ in range(10):
+                    toggle_like(self.bob.id, self.msg.id)
+                    db.session.commit()
+
+        threads = [threading.Thread(target=toggle_many) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        db.session.expire_all()
+        self.assertEqual(self.likers(), set())
+        self.assertEqual(self.bob.likes_count, 0)
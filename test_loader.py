@@ -0,0 +1,84 @@
+"""Bulk loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_loader.py
+
+import gzip
+import os
+import tempfile
+
+from sqlalchemy import inspect
+
+from app import app
+from models import db, User
+import loader
+from testcase import DatabaseTestCase
+
+db.create_all()
+
+
+class LoaderTestCase(DatabaseTestCase):
+    """Test chunked CSV loading with deferred indexes."""
+
+    def setUp(self):
+        super().setUp()
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+        super().tearDown()
+
+    def write(self, name, text):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_load_files(self):
+        rows = [f'u{i}@test.com,u{i},HASHED,"says ""hi"", {i}"\n'
+                for i in range(5)] + ["u5@test.com,u5,HASHED,\n"]
+        users = self.write('users.csv',
+                           "email,username,password,bio\n" + "".join(rows))
+        messages = self.write('messages.csv', "text,timestamp,user_id\n")
+
+        progress = []
+        loader.load_files([('users', users), ('messages', messages)],
+                          chunk_size=2, echo=progress.append)
+
+        self.assertEqual(User.query.count(), 6)
+        self.assertEqual(User.query.filter_by(username='u3').one().bio,
+                         'says "hi", 3')
+        self.assertIsNone(User.query.filter_by(username='u5').one().bio)
+        self.assertEqual([line.split(' (')[0] for line in progress
+                          if line.startswith('users:')],
+                         ['users: 2 rows', 'users: 4 rows', 'users: 6 rows'])
+
+        index_names = {index['name'] for index in
+                       inspect(db.engine).get_indexes('messages')}
+        self.assertIn('ix_messages_user_id_timestamp_id', index_names)
+
+    def test_gzipped_shards(self):
+        for shard in range(3):
+            with gzip.open(os.path.join(self.dir.name,
+                                        f'users-{shard:04d}.csv.gz'),
+                           'wt') as f:
+                f.write("email,username,password\n"
+                        f"u{shard}@test.com,u{shard},HASHED\n")
+
+        loader.load_files(
+            [('users', os.path.join(self.dir.name, 'users*.csv*'))],
+            echo=lambda line: None)
+        self.assertEqual([user.username
+                          for user in User.query.order_by(User.id)],
+                         ['u0', 'u1', 'u2'])
+
+        with self.assertRaises(FileNotFoundError):
+            loader.load_files(
+                [('users', os.path.join(self.dir.name, 'none*.csv'))],
+                echo=lambda line: None)
+
+    def test_unknown_column(self):
+        path = self.write('users.csv', "email,nickname\na@test.com,a\n")
+        with self.assertRaises(ValueError):
+            loader.load_csv(User.__table__, path, echo=lambda line: None)
@@ -9,6 +9,7 @@ from app import app, CURR_USER_KEY
 import os
 from unittest import TestCase
 
+from cache import cache
 from models import db, connect_db, Message, User, Follows
 
 # BEFORE we import our app, let's set an environmental variable
@@ -41,6 +42,7 @@ class MessageViewTestCase(TestCase):
 
         User.query.delete()
         Message.query.delete()
+        cache.clear()
 
         self.client = app.test_client()
 
@@ -0,0 +1,105 @@
+"""Metrics tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_metrics.py
+
+
+from flask import Flask
+from prometheus_client import REGISTRY
+
+from app import app, CURR_USER_KEY
+from metrics import metrics
+from models import db, User
+from passwords import hasher
+from testcase import DatabaseTestCase
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsTestCase(DatabaseTestCase):
+    """Test request, SQL and bcrypt metrics."""
+
+    def setUp(self):
+        super().setUp()
+        self.rounds = hasher.rounds
+        hasher.rounds = 4
+        self.user = User.signup(username="alice", email="alice@test.com",
+                                password="abc123", image_url=None)
+        db.session.commit()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        hasher.rounds = self.rounds
+        super().tearDown()
+
+    def test_request_metrics(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user.id
+
+        requests = sample('warbler_requests_total', endpoint='homepage',
+                          method='GET', status='200')
+        queries = sample('warbler_request_queries_sum', endpoint='homepage')
+        sql_seconds = sample('warbler_request_sql_seconds_sum',
+                             endpoint='homepage')
+
+        resp = self.client.get("/")
+        resp.close()
+
+        self.assertEqual(sample('warbler_requests_total', endpoint='homepage',
+                                method='GET', status='200'), requests + 1)
+        self.assertGreater(sample('warbler_request_queries_sum',
+                                  endpoint='homepage'), queries)
+        self.assertGreater(sample('warbler_request_sql_seconds_sum',
+                                  endpoint='homepage'), sql_seconds)
+        self.assertEqual(sample('warbler_request_seconds_count',
+                                endpoint='homepage'), requests + 1)
+
+    def test_bcrypt_metrics(self):
+        checks = sample('warbler_bcrypt_seconds_count', endpoint='login',
+                        operation='check')
+
+        resp = self.client.post("/login", data={"username": "alice",
+                                                "password": "abc123"})
+        resp.close()
+
+        self.assertEqual(sample('warbler_bcrypt_seconds_count',
+                                endpoint='login', operation='check'),
+                         checks + 1)
+
+    def test_metrics_view(self):
+        scraped = Flask(__name__)
+        scraped.config.update(METRICS_ENABLED=True, METRICS_TOKEN='s3cret')
+        metrics.init_app(scraped)
+        scraper = scraped.test_client()
+
+        self.client.get("/login").close()
+        self.assertEqual(scraper.get("/metrics").status_code, 401)
+        resp = scraper.get("/metrics",
+                           headers={'Authorization': 'Bearer wrong'})
+        self.assertEqual(resp.status_code, 401)
+
+        resp = scraper.get("/metrics",
+                           headers={'Authorization': 'Bearer s3cret'})
+        resp.close()
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith('text/plain'))
+        text = resp.get_data(as_text=True)
+        self.assertIn('warbler_request_seconds_bucket{endpoint="login"', text)
+        self.assertNotIn('endpoint="metrics"', text)
+
+    def test_metrics_off_by_default(self):
+        self.assertNotIn('metrics', app.view_functions)
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+        untokened = Flask(__name__)
+        untokened.config['METRICS_ENABLED'] = True
+        with self.assertRaises(RuntimeError):
+            metrics.init_app(untokened)
@@ -0,0 +1,58 @@
+"""Password hashing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+import threading
+
+from app import app
+from models import db, User
+from passwords import hasher, PasswordHasher, PasswordHasherBusy
+from testcase import DatabaseTestCase
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PasswordTestCase(DatabaseTestCase):
+    """Test cost changes and load shedding."""
+
+    def setUp(self):
+        super().setUp()
+        self.rounds = hasher.rounds
+        hasher.rounds = 4
+        self.user = User.signup(username="alice", email="alice@test.com",
+                                password="abc123", image_url=None)
+        db.session.commit()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        hasher.rounds = self.rounds
+        super().tearDown()
+
+    def test_rehash_on_login(self):
+        self.assertTrue(self.user.password.startswith('$2b$04$'))
+
+        hasher.rounds = 5
+        resp = self.client.post("/login", data={"username": "alice",
+                                                "password": "abc123"})
+        self.assertEqual(resp.status_code, 302)
+
+        db.session.refresh(self.user)
+        self.assertTrue(self.user.password.startswith('$2b$05$'))
+        self.assertTrue(User.authenticate("alice", "abc123"))
+        self.assertFalse(User.authenticate("alice", "wrong!"))
+
+    def test_busy(self):
+        busy = PasswordHasher()
+        busy.init_app(app)
+        busy.slots = threading.BoundedSemaphore(1)
+        busy.slots.acquire()
+
+        with self.assertRaises(PasswordHasherBusy):
+            busy.hash("abc123")
+
+        busy.slots.release()
+        self.assertTrue(busy.check(busy.hash("abc123"), "abc123"))
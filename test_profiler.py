@@ -0,0 +1,114 @@
+"""Request profiler tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_profiler.py
+
+import os
+import tempfile
+
+from app import app, CURR_USER_KEY
+from cache import cache, FileCache
+from models import db, User
+from passwords import hasher
+from profiler import profiler, profile_user, TOGGLES_KEY
+from testcase import DatabaseTestCase
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ProfilerTestCase(DatabaseTestCase):
+    """Test profiling requests on demand."""
+
+    def setUp(self):
+        super().setUp()
+        self.rounds = hasher.rounds
+        hasher.rounds = 8
+        self.user = User.signup(username="alice", email="alice@test.com",
+                                password="abc123", image_url=None)
+        db.session.commit()
+
+        self.dir = tempfile.TemporaryDirectory()
+        self.config = {key: app.config[key]
+                       for key in ('PROFILE_DIR', 'PROFILE_INTERVAL')}
+        app.config['PROFILE_DIR'] = self.dir.name
+        app.config['PROFILE_INTERVAL'] = 0.001
+        profiler._toggles_read_at = 0
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config.update(self.config)
+        self.dir.cleanup()
+        hasher.rounds = self.rounds
+        cache.clear()
+        super().tearDown()
+
+    def profiles(self):
+        return sorted(os.listdir(self.dir.name))
+
+    def read_profile(self, name):
+        with open(os.path.join(self.dir.name, name)) as f:
+            return f.read().splitlines()
+
+    def test_signed_header(self):
+        resp = self.client.post("/login",
+                                data={"username": "alice",
+                                      "password": "abc123"},
+                                headers={'X-Profile': profiler.make_token()})
+        resp.close()
+
+        name = resp.headers['X-Profile-Output']
+        self.assertEqual(self.profiles(), [name])
+        lines = self.read_profile(name)
+        self.assertTrue(lines)
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            self.assertGreater(int(count), 0)
+
+        # bcrypt, sampled on the hashing thread, shows under the wait for it
+        self.assertTrue(any(
+            'passwords.py:PasswordHasher._run;flask_bcrypt.py:' in line
+            for line in lines))
+
+    def test_bad_signature(self):
+        resp = self.client.get("/login", headers={'X-Profile': 'forged'})
+        resp.close()
+
+        self.assertNotIn('X-Profile-Output', resp.headers)
+        self.assertEqual(self.profiles(), [])
+
+    def test_user_toggle(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user.id
+        profile_user(self.user.id, endpoint='homepage', requests=1)
+
+        self.client.get("/messages/new").close()
+        self.assertEqual(self.profiles(), [])
+
+        self.client.get("/").close()
+        self.client.get("/").close()
+        profiles = self.profiles()
+        self.assertEqual(len(profiles), 1)
+        self.assertIn('-homepage-', profiles[0])
+
+    def test_toggle_commands_need_shared_cache(self):
+        runner = app.test_cli_runner()
+        args = ['profile', 'user', str(self.user.id)]
+
+        result = runner.invoke(args=args)
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn("file://", result.output)
+        self.assertIsNone(cache.get(TOGGLES_KEY))
+
+        backend = cache.backend
+        cache.backend = FileCache(os.path.join(self.dir.name, 'cache.db'))
+        try:
+            result = runner.invoke(args=args)
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn(str(self.user.id), cache.get(TOGGLES_KEY))
+            runner.invoke(args=['profile', 'clear'])
+            self.assertIsNone(cache.get(TOGGLES_KEY))
+        finally:
+            cache.backend = backend
@@ -0,0 +1,140 @@
+"""Query budget tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_querybudget.py
+
+from app import app, CURR_USER_KEY
+from cache import cache
+from models import db, User, Message, Follows, Likes
+from passwords import hasher
+from querybudget import (budget_of, max_queries, query_budget,
+                         QueryBudgetExceeded)
+from testcase import DatabaseTestCase
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+AUTHORS = 20
+
+
+class QueryBudgetTestCase(DatabaseTestCase):
+    """Test that every view stays within its query budget.
+
+    There's enough data that a query per row would blow any budget, and
+    caches start cold, so each request does the most work it ever does.
+    """
+
+    def setUp(self):
+        """Bob follows, is followed by and likes the messages of 20 authors."""
+
+        super().setUp()
+        self.rounds = hasher.rounds
+        hasher.rounds = 4
+
+        self.bob = User.signup(username="bob", email="bob@test.com",
+                               password="abc123", image_url=None)
+        authors = [User(email=f"author{i}@test.com", username=f"author{i}",
+                        password="HASHED_PASSWORD") for i in range(AUTHORS)]
+        db.session.add_all(authors)
+        db.session.commit()
+
+        messages = [Message(text=f"msg {i}", user_id=user.id)
+                    for i in range(2) for user in authors + [self.bob]]
+        db.session.add_all(messages)
+        db.session.add_all([Follows(user_being_followed_id=user.id,
+                                    user_following_id=self.bob.id)
+                            for user in authors])
+        db.session.add_all([Follows(user_being_followed_id=self.bob.id,
+                                    user_following_id=user.id)
+                            for user in authors])
+        db.session.commit()
+        db.session.add_all([Likes(user_id=self.bob.id, message_id=msg.id)
+                            for msg in messages if msg.user_id != self.bob.id])
+        db.session.commit()
+
+        self.bob_id = self.bob.id
+        self.author_id = authors[0].id
+        self.message_id = messages[0].id
+        self.own_message_id = messages[-1].id
+        self.client = app.test_client()
+
+    def tearDown(self):
+        hasher.rounds = self.rounds
+        super().tearDown()
+
+    def check(self, method, url, data=None, logged_in=True):
+        """Request `url` with cold caches; fail if it goes over budget."""
+
+        endpoint, _ = app.url_map.bind('localhost').match(url.split('?')[0],
+                                                          method)
+        budget = budget_of(app.view_functions[endpoint])
+
+        with self.client.session_transaction() as sess:
+            sess.clear()
+            if logged_in:
+                sess[CURR_USER_KEY] = self.bob_id
+        cache.clear()
+        db.session.expunge_all()
+
+        with max_queries(budget, f"{method} {url}"):
+            resp = self.client.open(url, method=method, data=data)
+            resp.get_data()
+            resp.close()
+        self.assertLess(resp.status_code, 400, f"{method} {url}")
+
+    def test_every_view_has_a_budget(self):
+        for endpoint, view in app.view_functions.items():
+            if view.__module__ == 'app':
+                self.assertIsNotNone(budget_of(view), endpoint)
+
+    def test_pages(self):
+        bob, author = self.bob_id, self.author_id
+        for url in ["/", f"/users/{author}", f"/users/{bob}",
+                    f"/users/{bob}/following", f"/users/{bob}/followers",
+                    f"/users/{bob}/likes", "/users", "/users?q=author",
+                    f"/messages/{self.message_id}", "/messages/new",
+                    "/users/profile", "/logout"]:
+            with self.subTest(url=url):
+                self.check('GET', url)
+
+        for url in ["/", "/signup", "/login", "/logout"]:
+            with self.subTest(url=url, logged_in=False):
+                self.check('GET', url, logged_in=False)
+
+    def test_actions(self):
+        bob = self.bob_id
+        actions = [
+            ("/signup", {"username": "carl", "email": "carl@test.com",
+                         "password": "abc123"}, False),
+            ("/login", {"username": "bob", "password": "abc123"}, False),
+            (f"/users/add_like/{self.message_id}", None, True),
+            (f"/users/add_like/{self.message_id}", None, True),
+            (f"/users/stop-following/{self.author_id}", None, True),
+            (f"/users/follow/{self.author_id}", None, True),
+            ("/messages/new", {"text": "Hello"}, True),
+            (f"/messages/{self.own_message_id}/delete", None, True),
+            ("/users/profile", {"username": "bobby", "email": "bob@test.com",
+                                "password": "abc123"}, True),
+            ("/users/delete", None, True),
+        ]
+        for url, data, logged_in in actions:
+            with self.subTest(url=url):
+                self.check('POST', url, data, logged_in)
+
+        self.assertIsNone(db.session.get(User, bob))
+
+    def test_failure_shows_sql(self):
+        @query_budget(1)
+        def view():
+            User.query.count()
+            Message.query.count()
+
+        with self.assertRaises(QueryBudgetExceeded) as cm:
+            with max_queries(budget_of(view), "view"):
+                view()
+
+        message = str(cm.exception)
+        self.assertIn("view ran 2 queries, over its budget of 1", message)
+        self.assertIn("FROM messages", message)
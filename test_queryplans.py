@@ -0,0 +1,30 @@
+"""Query plan tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_queryplans.py
+
+from app import app
+from models import db
+import queryplans
+from testcase import DatabaseTestCase
+
+db.create_all()
+
+
+class QueryPlanTestCase(DatabaseTestCase):
+    """Test that hot queries use their indexes.
+
+    The tables are empty, so on Postgres sequential scans are turned off:
+    otherwise the planner would rightly prefer them to any index.
+    """
+
+    def test_hot_queries_use_indexes(self):
+        problems = queryplans.plan_problems(disable=('seqscan',))
+        self.assertEqual(problems, [], '\n\n'.join(problems))
+
+    def test_likes_page_needs_no_sort(self):
+        query, index = queryplans.hot_queries()['likes']
+        plan = '\n'.join(queryplans.explain(query, ('seqscan', 'sort')))
+        self.assertNotIn('TEMP B-TREE', plan)
+        self.assertNotIn('Sort', plan)
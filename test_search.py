@@ -0,0 +1,122 @@
+"""Username search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+from app import app
+from models import db, User
+import search
+from search import search_users
+from testcase import DatabaseTestCase
+
+db.create_all()
+
+
+class SearchTestCase(DatabaseTestCase):
+    """Test ranking, paging and freshness of username search."""
+
+    USERNAMES = ["bobcat", "Bob", "jimbob", "bobby", "robert", "alice"]
+
+    def setUp(self):
+        super().setUp()
+        db.session.add_all([User(email=f"{name}@test.com", username=name,
+                                 password="HASHED_PASSWORD")
+                            for name in self.USERNAMES])
+        db.session.commit()
+
+    def usernames(self, q, after=None, per_page=10):
+        users, next_cursor = search_users(q, after, per_page)
+        return [user.username for user in users], next_cursor
+
+    def test_ranking(self):
+        # most similar first (so an exact match leads)
+        self.assertEqual(self.usernames("bob"),
+                         (["Bob", "bobby", "bobcat", "jimbob"], None))
+
+        # short queries only match prefixes, in username order
+        self.assertEqual(self.usernames("bo"),
+                         (["Bob", "bobby", "bobcat"], None))
+        self.assertEqual(self.usernames("zzz"), ([], None))
+
+    def test_paging(self):
+        page, cursor = self.usernames("bob", None, 3)
+        self.assertEqual(page, ["Bob", "bobby", "bobcat"])
+        self.assertEqual(self.usernames("bob", cursor, 3), (["jimbob"], None))
+
+        page, cursor = self.usernames("bo", None, 2)
+        self.assertEqual(page, ["Bob", "bobby"])
+        self.assertEqual(self.usernames("bo", cursor, 2), (["bobcat"], None))
+
+        with self.assertRaises(ValueError):
+            search_users("bo", "garbage")
+
+    def test_substring_results_capped(self):
+        limit = search.MAX_SUBSTRING_RESULTS
+        search.MAX_SUBSTRING_RESULTS = 2
+        try:
+            page, cursor = self.usernames("bob", None, 3)
+            self.assertEqual(page, ["Bob", "bobby"])
+            self.assertIsNone(cursor)
+        finally:
+            search.MAX_SUBSTRING_RESULTS = limit
+
+    def test_sees_new_users(self):
+        self.assertEqual(self.usernames("carol"), ([], None))
+
+        db.session.add(User(email="carol@test.com", username="carol",
+                            password="HASHED_PASSWORD"))
+        db.session.commit()
+        self.assertEqual(self.usernames("carol"), (["carol"], None))
+
+        User.query.filter_by(username="carol").delete()
+        db.session.commit()
+        self.assertEqual(self.usernames("carol"), ([], None))
+
+
+class DirectoryTestCase(DatabaseTestCase):
+    """Test the paged, streamed /users directory."""
+
+    def setUp(self):
+        super().setUp()
+        db.session.add_all([User(email=f"user{i}@test.com",
+                                 username=f"user{i}",
+                                 password="HASHED_PASSWORD")
+                            for i in range(5)])
+        db.session.commit()
+        self.per_page = app.config['USERS_PER_PAGE']
+        app.config['USERS_PER_PAGE'] = 2
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['USERS_PER_PAGE'] = self.per_page
+        super().tearDown()
+
+    def test_pages(self):
+        ids = [user.id for user in User.query.order_by(User.id)]
+
+        resp = self.client.get("/users")
+        self.assertTrue(resp.is_streamed)
+        html = resp.data.decode()
+        self.assertIn('<p>@user0</p>', html)
+        self.assertIn('<p>@user1</p>', html)
+        self.assertNotIn('<p>@user2</p>', html)
+        self.assertIn(f'href="?after={ids[1]}"', html)
+
+        html = self.client.get(f"/users?after={ids[3]}").data.decode()
+        self.assertIn('<p>@user4</p>', html)
+        self.assertNotIn('?after=', html)
+
+        html = self.client.get(f"/users?after={ids[4]}").data.decode()
+        self.assertIn('Sorry, no users found', html)
+
+    def test_search_pages(self):
+        html = self.client.get("/users?q=user").data.decode()
+        self.assertIn('href="?q=user&after=2"', html)
+
+        html = self.client.get("/users?q=user&after=4").data.decode()
+        self.assertIn('<p>@user', html)
+        self.assertNotIn('after=', html)
+
+        self.assertEqual(self.client.get("/users?q=us&after=x").status_code,
+                         400)
@@ -0,0 +1,98 @@
+"""Slow-query log tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_slowqueries.py
+
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+from app import app, CURR_USER_KEY
+from models import db, User
+import slowqueries
+from slowqueries import slow_queries, normalize, shape
+from testcase import DatabaseTestCase
+
+db.create_all()
+
+
+class SlowQueryLogTestCase(DatabaseTestCase):
+    """Test logging of statements over the threshold."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User(email="alice@test.com", username="alice",
+                         password="HASHED_PASSWORD")
+        db.session.add(self.user)
+        db.session.commit()
+        self.threshold = slow_queries.threshold
+        self.explain_rate = slow_queries.explain_rate
+        self.client = app.test_client()
+
+    def tearDown(self):
+        slow_queries.threshold = self.threshold
+        slow_queries.explain_rate = self.explain_rate
+        super().tearDown()
+
+    def test_normalize(self):
+        self.assertEqual(
+            normalize("SELECT id\n  FROM messages WHERE user_id IN "
+                      "(%(user_id_1_1)s, %(user_id_1_2)s) AND text = 'hi' "
+                      "LIMIT 20"),
+            "SELECT id FROM messages WHERE user_id IN (?, ...) "
+            "AND text = ? LIMIT ?")
+        self.assertEqual(normalize("SELECT users_1.id FROM users AS users_1 "
+                                   "WHERE users_1.id IN (?, ?, ?)"),
+                         "SELECT users_1.id FROM users AS users_1 "
+                         "WHERE users_1.id IN (?, ...)")
+
+    def test_shape(self):
+        self.assertEqual(shape((1, 2, 3, 'a')), "(int ×3, str)")
+        self.assertEqual(shape({'id': 1, 'q': None}), "(int, NoneType)")
+        self.assertEqual(shape([(1, 'a'), (2, 'b')], executemany=True),
+                         "2 rows of (int, str)")
+
+    def test_logs_slow_queries(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user.id
+        slow_queries.threshold = 0
+
+        with self.assertLogs(app.logger, 'WARNING') as logs:
+            self.client.get(f"/users/{self.user.id}").close()
+
+        entry = next(line for line in logs.output
+                     if 'FROM messages' in line)
+        self.assertIn("in users_show: SELECT", entry)
+        self.assertIn("parameters: (int", entry)
+        self.assertNotIn("plan:", entry)
+
+    def test_fast_queries_not_logged(self):
+        slow_queries.threshold = 60
+
+        with self.assertNoLogs(app.logger, 'WARNING'):
+            User.query.count()
+
+    def test_explains_off_the_request_thread(self):
+        slow_queries.threshold = 0
+        slow_queries.explain_rate = 1
+        conn = SimpleNamespace(
+            dialect=SimpleNamespace(name='postgresql'),
+            engine=SimpleNamespace(url='postgresql://warbler@localhost/x'))
+        threads = []
+
+        def explain(engine, statement, parameters):
+            threads.append(threading.current_thread())
+            self.assertEqual(engine.pool.size(), 1)
+            return ["Seq Scan on users"]
+
+        with mock.patch.object(slowqueries, 'explain', explain), \
+                self.assertLogs(app.logger, 'WARNING') as logs:
+            slow_queries.before_execute(conn, None, "SELECT 1", (), None,
+                                        False)
+            slow_queries.after_execute(conn, None, "SELECT 1", (), None,
+                                       False)
+            slow_queries._explains.join()
+
+        self.assertNotIn(threading.current_thread(), threads)
+        self.assertIn("    Seq Scan on users", logs.output[0])
@@ -0,0 +1,198 @@
+"""Precomputed timeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timelines.py
+
+import os
+import tempfile
+
+from app import app, CURR_USER_KEY
+from datetime import datetime, timedelta
+
+from cache import cache, FileCache, MemoryCache
+from models import db, User, Message, Follows
+import feeds
+import timelines
+from testcase import DatabaseTestCase
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TimelineTestCase(DatabaseTestCase):
+    """Test that writes keep cached timelines up to date."""
+
+    def setUp(self):
+        """Create two users; alice will follow bob."""
+
+        super().setUp()
+
+        self.alice = User.signup(username="alice", email="alice@foo.com",
+                                 password="abc123", image_url=None)
+        self.bob = User.signup(username="bob", email="bob@foo.com",
+                               password="abc123", image_url=None)
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def login(self, client, user):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user.id
+
+    def test_fan_out_follow_and_delete(self):
+        alice_id, bob_id = self.alice.id, self.bob.id
+
+        with self.client as c:
+            self.login(c, self.alice)
+            c.get("/")
+            self.assertIsNotNone(cache.get(timelines.timeline_key(alice_id)))
+
+            c.post(f"/users/follow/{bob_id}")
+
+            self.login(c, self.bob)
+            c.post("/messages/new", data={"text": "Hi from bob"})
+            msg = Message.query.one()
+
+            # alice's cached timeline got the message without a rebuild
+            self.assertEqual(timelines.message_ids(alice_id), [msg.id])
+
+            self.login(c, self.alice)
+            html = c.get("/").data.decode()
+            self.assertIn('<p>Hi from bob</p>', html)
+
+            c.post(f"/users/stop-following/{bob_id}")
+            self.assertEqual(timelines.message_ids(alice_id), [])
+
+            c.post(f"/users/follow/{bob_id}")
+            self.assertEqual(timelines.message_ids(alice_id), [msg.id])
+
+            self.login(c, self.bob)
+            c.post(f"/messages/{msg.id}/delete")
+            self.assertEqual(timelines.message_ids(alice_id), [])
+            self.assertEqual(timelines.message_ids(bob_id), [])
+
+    def walk(self, page):
+        """Ids of every message in a feed, following `page(before)`'s cursors."""
+
+        ids, before = [], None
+        while True:
+            messages, cursor = page(before)
+            ids += [msg.id for msg in messages]
+            if cursor is None:
+                return ids
+            before = feeds.decode_cursor(cursor)
+
+    def assert_cached_walk_matches_database(self, user_id):
+        db.session.expunge_all()
+        self.assertEqual(
+            self.walk(lambda before: timelines.home_page(user_id, before, 3)),
+            self.walk(lambda before: feeds.paginate(
+                feeds.home_query(user_id), before, 3)))
+
+    def test_capped_timeline_after_removals(self):
+        """Following someone with old messages doesn't hide cut-off ones."""
+
+        carol = User.signup(username="carol", email="carol@foo.com",
+                            password="abc123", image_url=None)
+        dave = User.signup(username="dave", email="dave@foo.com",
+                           password="abc123", image_url=None)
+        db.session.commit()
+        alice_id, bob_id = self.alice.id, self.bob.id
+        carol_id, dave_id = carol.id, dave.id
+
+        # bob and carol post alternately; dave posted long before
+        start = datetime(2020, 1, 1)
+        db.session.add_all(
+            [Message(text=f"bob {i}", user_id=bob_id,
+                     timestamp=start + timedelta(minutes=2 * i))
+             for i in range(15)]
+            + [Message(text=f"carol {i}", user_id=carol_id,
+                       timestamp=start + timedelta(minutes=2 * i + 1))
+               for i in range(15)]
+            + [Message(text=f"dave {i}", user_id=dave_id,
+                       timestamp=start - timedelta(days=1, minutes=i))
+               for i in range(5)])
+        db.session.add_all([Follows(user_being_followed_id=followed_id,
+                                    user_following_id=alice_id)
+                            for followed_id in (bob_id, carol_id)])
+        db.session.commit()
+
+        length = timelines.TIMELINE_LENGTH
+        timelines.TIMELINE_LENGTH = 10
+        try:
+            self.assertFalse(timelines.get_timeline(alice_id)['complete'])
+
+            # unfollow, then follow
+            Follows.query.filter_by(user_being_followed_id=carol_id).delete()
+            db.session.commit()
+            timelines.remove_followed(alice_id, carol_id)
+            db.session.add(Follows(user_being_followed_id=dave_id,
+                                   user_following_id=alice_id))
+            db.session.commit()
+            timelines.add_followed(alice_id, dave_id)
+            self.assert_cached_walk_matches_database(alice_id)
+
+            # delete, then follow
+            newest = (Message.query.filter_by(user_id=bob_id)
+                      .order_by(Message.timestamp.desc()).first())
+            timelines.remove_message(newest.id, bob_id)
+            db.session.delete(newest)
+            db.session.add(Follows(user_being_followed_id=carol_id,
+                                   user_following_id=alice_id))
+            db.session.commit()
+            timelines.add_followed(alice_id, carol_id)
+            self.assert_cached_walk_matches_database(alice_id)
+        finally:
+            timelines.TIMELINE_LENGTH = length
+
+    def test_deleted_account_leaves_timelines(self):
+        alice_id, bob_id = self.alice.id, self.bob.id
+        db.session.add(Follows(user_being_followed_id=bob_id,
+                               user_following_id=alice_id))
+        db.session.add(Message(text="Hi from bob", user_id=bob_id))
+        db.session.commit()
+        self.assertEqual(len(timelines.message_ids(alice_id)), 1)
+
+        with self.client as c:
+            self.login(c, self.bob)
+            c.post("/users/delete")
+
+        self.assertEqual(timelines.message_ids(alice_id), [])
+
+    def test_timelines_expire(self):
+        alice_id = self.alice.id
+        self.assertEqual(timelines.message_ids(alice_id), [])
+
+        # written without fanning out, as another worker process would
+        db.session.add(Message(text="Hi", user_id=alice_id))
+        db.session.commit()
+        self.assertEqual(timelines.message_ids(alice_id), [])
+
+        cache.update(timelines.timeline_key(alice_id),
+                     lambda timeline: {**timeline, 'expires': 0})
+        self.assertEqual(len(timelines.message_ids(alice_id)), 1)
+
+    def test_memory_cache_evicts_least_recently_used(self):
+        backend = MemoryCache(max_entries=2)
+        backend.set('a', 1)
+        backend.set('b', 2)
+        backend.get('a')
+        backend.set('c', 3)
+
+        self.assertEqual(backend.get('a'), 1)
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('c'), 3)
+
+    def test_file_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = FileCache(os.path.join(tmp, 'cache.sqlite'))
+            self.assertIsNone(backend.update('k', lambda v: v + [1]))
+
+            backend.set('k', [0])
+            self.assertEqual(backend.update('k', lambda v: v + [1]), [0, 1])
+            self.assertEqual(backend.get('k'), [0, 1])
+
+            backend.delete('k')
+            self.assertIsNone(backend.get('k'))
@@ -42,6 +42,12 @@ class UserModelTestCase(TestCase):
 
         self.client = app.test_client()
 
+    def tearDown(self):
+        """Don't leave this test's objects in the shared identity map."""
+
+        db.session.rollback()
+        db.session.remove()
+
     def test_user_model(self):
         """Does basic model work?"""
 
@@ -5,6 +5,7 @@ from unittest import TestCase
 from sqlalchemy import exc
 from flask import session
 
+from cache import cache
 from models import db, User, Message, Follows
 
 # BEFORE we import our app, let's set an environmental variable
@@ -34,6 +35,7 @@ class UserViewsTestCase(TestCase):
         User.query.delete()
         Message.query.delete()
         Follows.query.delete()
+        cache.clear()
 
         self.app_context = app.app_context()
 
@@ -0,0 +1,122 @@
+"""Write-behind queue tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_writebehind.py
+
+from unittest import mock
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows, Likes
+import writebehind
+from writebehind import write_behind, MAX_FLUSH_ATTEMPTS
+from testcase import DatabaseTestCase
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class WriteBehindTestCase(DatabaseTestCase):
+    """Test queued likes and follows, and reading your own pending writes."""
+
+    def setUp(self):
+        super().setUp()
+
+        self.alice = User(email="alice@test.com", username="alice",
+                          password="HASHED_PASSWORD")
+        self.bob = User(email="bob@test.com", username="bob",
+                        password="HASHED_PASSWORD")
+        db.session.add_all([self.alice, self.bob])
+        db.session.commit()
+        self.msg = Message(text="hello", user_id=self.alice.id)
+        db.session.add(self.msg)
+        db.session.commit()
+
+        # flushed by hand below, not by the background thread
+        self.interval = write_behind.interval
+        write_behind.enabled, write_behind.interval = True, 3600
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.bob.id
+
+    def tearDown(self):
+        write_behind.flush()
+        write_behind.enabled, write_behind.interval = False, self.interval
+        super().tearDown()
+
+    def test_follow_pending_then_flushed(self):
+        self.client.post(f"/users/follow/{self.alice.id}")
+        self.assertEqual(Follows.query.count(), 0)
+
+        html = self.client.get(f"/users/{self.bob.id}/following").data.decode()
+        self.assertIn('<p>@alice</p>', html)
+        self.assertIn('Unfollow', html)
+
+        write_behind.flush()
+        db.session.expire_all()
+        self.assertEqual(Follows.query.count(), 1)
+        self.assertEqual(self.bob.following_count, 1)
+        self.assertEqual(self.alice.followers_count, 1)
+        self.assertEqual(write_behind.pending_follows(self.bob.id), {})
+
+    def test_opposing_changes_coalesce(self):
+        self.client.post(f"/users/follow/{self.alice.id}")
+        self.client.post(f"/users/stop-following/{self.alice.id}")
+        self.assertEqual(write_behind.pending_follows(self.bob.id),
+                         {self.alice.id: False})
+
+        html = self.client.get(f"/users/{self.bob.id}/following").data.decode()
+        self.assertNotIn('<p>@alice</p>', html)
+
+        write_behind.flush()
+        self.assertEqual(Follows.query.count(), 0)
+
+    def test_like_toggles_pending_state(self):
+        self.client.post(f"/users/add_like/{self.msg.id}")
+        self.assertEqual(write_behind.pending_likes(self.bob.id),
+                         {self.msg.id: True})
+        self.client.post(f"/users/add_like/{self.msg.id}")
+        self.assertEqual(write_behind.pending_likes(self.bob.id),
+                         {self.msg.id: False})
+        self.client.post(f"/users/add_like/{self.msg.id}")
+
+        write_behind.flush()
+        db.session.expire_all()
+        self.assertEqual([(like.user_id, like.message_id)
+                          for like in Likes.query],
+                         [(self.bob.id, self.msg.id)])
+        self.assertEqual(self.bob.likes_count, 1)
+
+        # own messages still can't be liked
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.alice.id
+        self.client.post(f"/users/add_like/{self.msg.id}")
+        self.assertEqual(write_behind.pending_likes(self.alice.id), {})
+
+    def test_failing_user_doesnt_block_others(self):
+        bob_id, alice_id = self.bob.id, self.alice.id
+        write_likes = writebehind.write_likes
+
+        def failing_for_bob(likes):
+            if any(user_id == bob_id for user_id, _ in likes):
+                raise ValueError("bad row")
+            write_likes(likes)
+
+        with mock.patch.object(writebehind, 'write_likes', failing_for_bob):
+            write_behind.set_like(bob_id, self.msg.id, True)
+            write_behind.set_follow(alice_id, bob_id, True)
+            with self.assertLogs(app.logger, 'WARNING'):
+                write_behind.flush()
+
+            self.assertEqual(Follows.query.count(), 1)
+            self.assertEqual(write_behind.pending_likes(bob_id),
+                             {self.msg.id: True})
+
+            with self.assertLogs(app.logger, 'ERROR') as logs:
+                for _ in range(MAX_FLUSH_ATTEMPTS - 1):
+                    write_behind.flush()
+            self.assertIn("Dropping user", logs.output[-1])
+            self.assertEqual(write_behind.pending_likes(bob_id), {})
+            self.assertEqual(Likes.query.count(), 0)
@@ -0,0 +1,25 @@
+"""Base class for tests that use the database."""
+
+from unittest import TestCase
+
+from cache import cache
+from models import db, User, Message, Follows, Likes
+
+
+class DatabaseTestCase(TestCase):
+    """Starts each test with empty tables and an empty cache."""
+
+    def setUp(self):
+        for model in (Likes, Follows, Message, User):
+            model.query.delete()
+        db.session.commit()
+        cache.clear()
+
+    def tearDown(self):
+        """Leave empty tables and identity map for the next test."""
+
+        db.session.rollback()
+        for model in (Likes, Follows, Message, User):
+            model.query.delete()
+        db.session.commit()
+        db.session.remove()
@@ -0,0 +1,200 @@
+"""Precomputed home timelines for Warbler.
+
+Each user's home timeline (their own messages plus those of everyone they
+follow) is kept in the cache as `{'complete': bool, 'entries': [...]}`,
+where entries are `[timestamp, message_id, author_id]` lists, oldest first,
+capped at TIMELINE_LENGTH. `complete` is false once older messages have
+been cut off, so pages past the cached window go to the database instead.
+
+Writes fan out to the timelines that already exist; a timeline that isn't
+in the cache is rebuilt from the database the next time it is read.
+Timelines also expire TIMELINE_TTL seconds after they're built. With the
+per-process memory:// cache, fan-out only reaches the process that made the
+write, so the TTL bounds how long other workers show a stale feed.
+"""
+
+import time
+from bisect import bisect_left
+
+from cache import cache
+from feeds import (TIMESTAMP_FORMAT, MESSAGES_PER_PAGE, home_query, paginate,
+                   messages_by_ids)
+from models import db, Message, Follows
+
+TIMELINE_LENGTH = 800
+
+TIMELINE_TTL = 300
+
+
+def timeline_key(user_id):
+    return f"timeline:{user_id}"
+
+
+def entry_for(msg):
+    """Timeline entry for message `msg`."""
+
+    return [msg.timestamp.strftime(TIMESTAMP_FORMAT), msg.id, msg.user_id]
+
+
+def rebuild_timeline(user_id):
+    """Build `user_id`'s timeline from the database and cache it."""
+
+    messages = (home_query(user_id)
+                .order_by(Message.timestamp.desc(), Message.id.desc())
+                .limit(TIMELINE_LENGTH)
+                .all())
+    timeline = {
+        'expires': time.time() + TIMELINE_TTL,
+        'complete': len(messages) < TIMELINE_LENGTH,
+        'entries': [entry_for(msg) for msg in reversed(messages)],
+    }
+    cache.set(timeline_key(user_id), timeline)
+    return timeline
+
+
+def get_timeline(user_id):
+    """Return `user_id`'s cached timeline, rebuilding it if needed."""
+
+    timeline = cache.get(timeline_key(user_id))
+    if timeline is None or timeline.get('expires', 0) <= time.time():
+        timeline = rebuild_timeline(user_id)
+    return timeline
+
+
+def message_ids(user_id, limit=MESSAGES_PER_PAGE):
+    """Return ids of the `limit` newest messages on `user_id`'s timeline."""
+
+    entries = get_timeline(user_id)['entries']
+    return [msg_id for _, msg_id, _ in entries[:-limit - 1:-1]]
+
+
+def cached_page(user_id, before=None, per_page=MESSAGES_PER_PAGE):
+    """Return `(message_ids, next_cursor)` from the cached timeline.
+
+    Returns None if the page reaches past what the cache holds.
+    """
+
+    timeline = get_timeline(user_id)
+    entries = timeline['entries']
+
+    end = len(entries)
+    if before:
+        timestamp, msg_id = before
+        end = bisect_left(entries,
+                          [timestamp.strftime(TIMESTAMP_FORMAT), msg_id],
+                          key=lambda entry: entry[:2])
+
+    page = entries[max(end - per_page - 1, 0):end][::-1]
+    if len(page) > per_page:
+        page = page[:per_page]
+        timestamp, msg_id, _ = page[-1]
+        return [e[1] for e in page], f"{timestamp}-{msg_id}"
+
+    if not timeline['complete']:
+        return None
+
+    return [e[1] for e in page], None
+
+
+def home_page(user_id, before=None, per_page=MESSAGES_PER_PAGE):
+    """Return `(messages, next_cursor)` for a page of `user_id`'s home feed."""
+
+    page = cached_page(user_id, before, per_page)
+    if page is None:
+        return paginate(home_query(user_id), before, per_page)
+
+    ids, next_cursor = page
+    return messages_by_ids(ids), next_cursor
+
+
+def audience_ids(author_id):
+    """Ids of users whose timelines show messages by `author_id`."""
+
+    followers = (db.session
+                 .query(Follows.user_following_id)
+                 .filter(Follows.user_being_followed_id == author_id))
+    return [author_id] + [user_id for (user_id,) in followers]
+
+
+def _insert(timeline, new_entries, complete=True):
+    entries = timeline['entries']
+    seen = {msg_id for _, msg_id, _ in entries}
+    new_entries = [e for e in new_entries if e[1] not in seen]
+    if not timeline['complete']:
+        # Older messages were cut off, and removals may since have shrunk
+        # the window; anything older than what's left would hide the cut-off
+        # messages of other authors from cached pages.
+        new_entries = [e for e in new_entries if entries and e > entries[0]]
+    merged = sorted(entries + new_entries)
+    return {
+        **timeline,
+        'complete': (timeline['complete'] and complete
+                     and len(merged) <= TIMELINE_LENGTH),
+        'entries': merged[-TIMELINE_LENGTH:],
+    }
+
+
+def _remove(timeline, keep):
+    return {
+        **timeline,
+        'entries': [e for e in timeline['entries'] if keep(e)],
+    }
+
+
+def fan_out(msg):
+    """Add new message `msg` to every cached timeline it belongs on."""
+
+    entry = entry_for(msg)
+    for user_id in audience_ids(msg.user_id):
+        cache.update(timeline_key(user_id),
+                     lambda timeline: _insert(timeline, [entry]))
+
+
+def remove_message(message_id, author_id):
+    """Take a deleted message off every cached timeline."""
+
+    for user_id in audience_ids(author_id):
+        cache.update(timeline_key(user_id),
+                     lambda timeline: _remove(
+                         timeline, lambda e: e[1] != message_id))
+
+
+def add_followed(user_id, followed_id):
+    """Merge `followed_id`'s recent messages into `user_id`'s timeline."""
+
+    messages = (Message
+                .query
+                .filter(Message.user_id == followed_id)
+                .order_by(Message.timestamp.desc(), Message.id.desc())
+                .limit(TIMELINE_LENGTH)
+                .all())
+    new_entries = [entry_for(msg) for msg in messages]
+    complete = len(messages) < TIMELINE_LENGTH
+    cache.update(timeline_key(user_id),
+                 lambda timeline: _insert(timeline, new_entries, complete))
+
+
+def remove_followed(user_id, followed_id):
+    """Drop `followed_id`'s messages from `user_id`'s timeline."""
+
+    cache.update(timeline_key(user_id),
+                 lambda timeline: _remove(
+                     timeline, lambda e: e[2] != followed_id))
+
+
+def remove_author(author_id, user_ids):
+    """Drop `author_id`'s messages from the timelines of `user_ids`.
+
+    For a deleted account: pass its audience_ids from before the deletion.
+    """
+
+    for user_id in user_ids:
+        cache.update(timeline_key(user_id),
+                     lambda timeline: _remove(
+                         timeline, lambda e: e[2] != author_id))
+
+
+def drop_timeline(user_id):
+    """Forget `user_id`'s timeline (e.g. when the account is deleted)."""
+
+    cache.delete(timeline_key(user_id))
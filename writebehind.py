@@ -0,0 +1,275 @@
+"""Write-behind queue for likes and follows.
+
+Off by default. With WRITE_BEHIND on, liking, unliking, following and
+unfollowing don't write to the database in the request. The views record
+the state the user wants ("bob likes message 7": yes/no) in an in-process
+queue, and a background thread writes everything queued in one transaction
+every WRITE_BEHIND_INTERVAL seconds, then recounts the affected users'
+counters.
+
+Only the latest wanted state of each (user, target) pair is kept, so a like
+and an unlike queued between flushes cancel out, and a flush can safely
+be retried. Until their changes are flushed, the user who made them sees
+them anyway: `CurrentUser.liked_ids` and `CurrentUser.following_ids`
+overlay the pending state on what's in the database. Counters catch up
+at the flush.
+
+If a flush fails, each user's changes are written again in a transaction
+of their own, so one bad row only holds back the changes of the user who
+made it. Those are retried at later flushes and dropped, with an error
+logged, after MAX_FLUSH_ATTEMPTS failures.
+
+The queue lives in one process, so a user only sees their own pending
+changes while their requests reach that process. Anything still queued is
+flushed at exit, but a crash loses up to one interval of clicks.
+"""
+
+import atexit
+import os
+import threading
+import time
+
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, User, Message, Likes, Follows
+import counters
+import timelines
+
+DEFAULT_INTERVAL = 0.5
+
+# Failed flushes of a user's changes before they're given up on
+MAX_FLUSH_ATTEMPTS = 5
+
+LIKE = 'like'
+FOLLOW = 'follow'
+
+
+def insert_ignoring_conflicts(table):
+    """INSERT into `table` that skips rows already there."""
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    return sqlite.insert(table).on_conflict_do_nothing()
+
+
+def existing_ids(table, ids):
+    """The subset of `ids` that are ids of rows in `table`."""
+
+    if not ids:
+        return set()
+    return set(db.session.scalars(
+        select(table.c.id).where(table.c.id.in_(ids))))
+
+
+def write_likes(wanted):
+    """Make likes match `wanted`, a dict of (user id, message id) -> bool."""
+
+    likes = Likes.__table__
+    messages = Message.__table__
+
+    unwanted = [pair for pair, liked in wanted.items() if not liked]
+    if unwanted:
+        db.session.execute(delete(likes).where(
+            tuple_(likes.c.user_id, likes.c.message_id).in_(unwanted)))
+
+    pairs = [pair for pair, liked in wanted.items() if liked]
+    if not pairs:
+        return
+
+    users = existing_ids(User.__table__, {user_id for user_id, _ in pairs})
+    found = {msg_id: (timestamp, author_id)
+             for msg_id, timestamp, author_id in db.session.execute(
+                 select(messages.c.id, messages.c.timestamp,
+                        messages.c.user_id)
+                 .where(messages.c.id.in_({msg_id for _, msg_id in pairs})))}
+
+    # skip likes of messages deleted since, and of the user's own messages
+    rows = [dict(user_id=user_id, message_id=msg_id,
+                 message_timestamp=found[msg_id][0])
+            for user_id, msg_id in pairs
+            if user_id in users and msg_id in found
+            and found[msg_id][1] != user_id]
+    if rows:
+        db.session.execute(insert_ignoring_conflicts(likes), rows)
+
+
+def write_follows(wanted):
+    """Make follows match `wanted`, a dict of (follower, followed) -> bool."""
+
+    follows = Follows.__table__
+
+    unwanted = [pair for pair, following in wanted.items() if not following]
+    if unwanted:
+        db.session.execute(delete(follows).where(
+            tuple_(follows.c.user_following_id,
+                   follows.c.user_being_followed_id).in_(unwanted)))
+
+    pairs = [pair for pair, following in wanted.items() if following]
+    users = existing_ids(User.__table__, {i for pair in pairs for i in pair})
+    rows = [dict(user_following_id=follower, user_being_followed_id=followed)
+            for follower, followed in pairs
+            if follower in users and followed in users]
+    if rows:
+        db.session.execute(insert_ignoring_conflicts(follows), rows)
+
+
+class WriteBehind:
+    """In-process queue of wanted like and follow states."""
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.interval = DEFAULT_INTERVAL
+        self._lock = threading.Lock()
+        self._pending = {}    # user id -> {(kind, target id): wanted}
+        self._flushing = {}   # the same, for changes being written now
+        self._flush_lock = threading.Lock()
+        self._failures = {}   # user id -> failed flushes of their changes
+        self._thread_pid = None
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.setdefault('WRITE_BEHIND', False)
+        self.interval = app.config.setdefault('WRITE_BEHIND_INTERVAL',
+                                              DEFAULT_INTERVAL)
+        atexit.register(self.flush)
+
+    def _put(self, user_id, kind, target_id, wanted):
+        with self._lock:
+            self._pending.setdefault(user_id, {})[kind, target_id] = wanted
+        self._ensure_thread()
+
+    def set_like(self, user_id, message_id, liked):
+        """Queue `user_id` liking (or not liking) `message_id`."""
+
+        self._put(user_id, LIKE, message_id, liked)
+
+    def set_follow(self, user_id, followed_id, following):
+        """Queue `user_id` following (or not following) `followed_id`."""
+
+        self._put(user_id, FOLLOW, followed_id, following)
+
+    def _pending_of(self, user_id, kind):
+        with self._lock:
+            changes = {}
+            for queue in (self._flushing, self._pending):
+                for (change_kind, target_id), wanted in (
+                        queue.get(user_id, {}).items()):
+                    if change_kind == kind:
+                        changes[target_id] = wanted
+            return changes
+
+    def pending_likes(self, user_id):
+        """{message id: liked} for `user_id`'s likes not yet written."""
+
+        return self._pending_of(user_id, LIKE)
+
+    def pending_follows(self, user_id):
+        """{user id: following} for `user_id`'s follows not yet written."""
+
+        return self._pending_of(user_id, FOLLOW)
+
+    def _ensure_thread(self):
+        # Started on first use, so each forked worker gets its own
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid != os.getpid():
+                self._thread_pid = os.getpid()
+                threading.Thread(target=self._run, name='write-behind',
+                                 daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        """Write everything queued so far, in one transaction if it can."""
+
+        with self._flush_lock:
+            with self._lock:
+                self._flushing, self._pending = self._pending, {}
+            queued = self._flushing
+            if not queued:
+                return
+
+            with self.app.app_context():
+                try:
+                    try:
+                        follows = self._write(queued)
+                    except Exception:
+                        db.session.rollback()
+                        self.app.logger.warning(
+                            "Write-behind flush failed; writing each "
+                            "user's changes separately", exc_info=True)
+                        follows = self._write_each(queued)
+                    else:
+                        self._failures.clear()
+                finally:
+                    with self._lock:
+                        self._flushing = {}
+
+                # A timeline rebuilt while these were pending missed them
+                for (user_id, followed_id), following in follows.items():
+                    if following:
+                        timelines.add_followed(user_id, followed_id)
+                    else:
+                        timelines.remove_followed(user_id, followed_id)
+
+    def _write(self, queued):
+        """Write `queued` changes in one transaction; return its follows."""
+
+        likes, follows = {}, {}
+        for user_id, changes in queued.items():
+            for (kind, target_id), wanted in changes.items():
+                if kind == LIKE:
+                    likes[user_id, target_id] = wanted
+                else:
+                    follows[user_id, target_id] = wanted
+
+        write_likes(likes)
+        write_follows(follows)
+        counters.recount(set(queued) | {followed for _, followed in follows})
+        db.session.commit()
+        return follows
+
+    def _write_each(self, queued):
+        """Write each user's changes on their own; return the follows written.
+
+        A user's changes that fail are requeued, or dropped once they've
+        failed MAX_FLUSH_ATTEMPTS times.
+        """
+
+        follows = {}
+        for user_id, changes in queued.items():
+            try:
+                follows.update(self._write({user_id: changes}))
+            except Exception:
+                db.session.rollback()
+                attempts = self._failures.get(user_id, 0) + 1
+                if attempts < MAX_FLUSH_ATTEMPTS:
+                    self._failures[user_id] = attempts
+                    self._requeue({user_id: changes})
+                else:
+                    self._failures.pop(user_id, None)
+                    self.app.logger.error(
+                        "Dropping user %s's write-behind changes after %s "
+                        "failed flushes: %r", user_id, attempts, changes,
+                        exc_info=True)
+            else:
+                self._failures.pop(user_id, None)
+        return follows
+
+    def _requeue(self, queued):
+        """Put back changes a failed flush didn't write (newer ones win)."""
+
+        with self._lock:
+            for user_id, changes in queued.items():
+                pending = self._pending.setdefault(user_id, {})
+                for key, wanted in changes.items():
+                    pending.setdefault(key, wanted)
+
+
+write_behind = WriteBehind()